@@ -1,5 +1,10 @@
 
+import os
+import math
 import time
+import hashlib
+import logging
+import platform
 import torch
 from torch import nn
 import torch.nn.functional as F
@@ -40,12 +45,27 @@ class SinusoidalPositionEncoder(torch.nn.Module):
         encoding = torch.cat([torch.sin(scaled_time), torch.cos(scaled_time)], dim=2)
         return encoding.type(dtype)
 
-    def forward(self, x):
+    def table(self, length: int, depth: int, dtype: torch.dtype, device: torch.device):
+        """Encodings of positions 1..>=length, cached per (depth, dtype, device) and grown on demand."""
+        cache = self.__dict__.setdefault("_table_cache", {})
+        key = (depth, dtype, device)
+        table = cache.get(key)
+        if table is None or table.size(1) < length:
+            # grow geometrically so a long stream does not rebuild the table on every chunk
+            size = max(length, 2 * table.size(1) if table is not None else 512)
+            positions = torch.arange(1, size + 1, device=device)[None, :]
+            table = self.encode(positions, depth, dtype)
+            cache[key] = table
+        return table
+
+    def forward(self, x, start_idx: int = 0):
         batch_size, timesteps, input_dim = x.size()
-        positions = torch.arange(1, timesteps + 1, device=x.device)[None, :]
-        position_encoding = self.encode(positions, input_dim, x.dtype).to(x.device)
-
-        return x + position_encoding
+        if torch.jit.is_tracing():
+            # keep the length dynamic in the traced graph instead of baking in the cached table
+            positions = torch.arange(start_idx + 1, start_idx + timesteps + 1, device=x.device)
+            return x + self.encode(positions[None, :], input_dim, x.dtype)
+        table = self.table(start_idx + timesteps, input_dim, x.dtype, x.device)
+        return x + table[:, start_idx : start_idx + timesteps]
 
 
 class PositionwiseFeedForward(torch.nn.Module):
@@ -137,6 +157,91 @@ class MultiHeadedAttentionSANM(nn.Module):
             x = x * mask
         return x
 
+    def forward_fsmn_chunk(self, inputs, cache=None, n_commit=None):
+        """FSMN memory for one streaming chunk.
+
+        The left context of the depthwise convolution is taken from the cached
+        committed frames of the previous chunk instead of zero padding.
+
+        Args:
+            inputs (torch.Tensor): Value tensor of the chunk (#batch, time, size).
+            cache (dict): Attention cache of this layer, "fsmn" is read and updated.
+            n_commit (int): Number of leading frames that will not be recomputed
+                with the next chunk (i.e. excluding the lookahead frames).
+
+        Returns:
+            torch.Tensor: Output tensor (#batch, time, size).
+            torch.Tensor: Left context for the next chunk.
+
+        """
+        t = inputs.size(1)
+        left_padding, right_padding = self.pad_fn.padding
+        if cache is not None and "fsmn" in cache:
+            x = torch.cat((cache["fsmn"], inputs), dim=1)
+        else:
+            x = inputs
+        n_cached = x.size(1) - t
+        if n_commit is None:
+            n_commit = t
+
+        fsmn_cache = x[:, : n_cached + n_commit, :][:, -left_padding:, :] if left_padding > 0 else None
+
+        x = F.pad(x.transpose(1, 2), (left_padding - n_cached, right_padding))
+        x = self.fsmn_block(x)
+        x = x.transpose(1, 2)
+        x = x + inputs
+        x = self.dropout(x)
+        return x, fsmn_cache
+
+    def forward_fsmn_packed(self, inputs, packing):
+        """FSMN memory of a packed batch.
+
+        The frames are scattered into a buffer with zero gaps between the
+        utterances, so the convolution never mixes neighbouring utterances, and
+        gathered back after it.
+
+        Args:
+            inputs (torch.Tensor): Packed value tensor (1, total_time, size).
+            packing (SequencePacking): Layout of the packed batch.
+
+        Returns:
+            torch.Tensor: Output tensor (1, total_time, size).
+
+        """
+        left_padding, right_padding = self.pad_fn.padding
+        x = inputs.new_zeros(1, packing.fsmn_size, inputs.size(-1))
+        x.index_copy_(1, packing.fsmn_index, inputs)
+        x = F.pad(x.transpose(1, 2), (left_padding, right_padding))
+        x = self.fsmn_block(x)
+        x = x.transpose(1, 2).index_select(1, packing.fsmn_index)
+        x = x + inputs
+        return self.dropout(x)
+
+    def forward_packed(self, x, packing):
+        """Compute attention over a packed batch, block-diagonal per utterance.
+
+        Args:
+            x (torch.Tensor): Packed input tensor (1, total_time, size).
+            packing (SequencePacking): Layout of the packed batch.
+
+        Returns:
+            torch.Tensor: Output tensor (1, total_time, d_model).
+
+        """
+        q_h, k_h, v_h, v = self.forward_qkv(x)
+        fsmn_memory = self.forward_fsmn_packed(v, packing)
+        q_h = q_h * self.d_k ** (-0.5)
+        outs = []
+        for q, k, value in zip(
+            q_h.split(packing.lengths, dim=2),
+            k_h.split(packing.lengths, dim=2),
+            v_h.split(packing.lengths, dim=2),
+        ):
+            attn = torch.softmax(torch.matmul(q, k.transpose(-2, -1)), dim=-1)
+            outs.append(torch.matmul(self.dropout(attn), value))
+        x = torch.cat(outs, dim=2).transpose(1, 2).reshape(1, -1, self.h * self.d_k)
+        return self.linear_out(x) + fsmn_memory
+
     def forward_qkv(self, x):
         """Transform query, key and value.
 
@@ -240,10 +345,12 @@ class MultiHeadedAttentionSANM(nn.Module):
 
         """
         q_h, k_h, v_h, v = self.forward_qkv(x)
+        # frames after n_commit are lookahead and will be fed again with the next chunk
+        n_commit = k_h.size(2) - chunk_size[2] if chunk_size is not None else k_h.size(2)
         if chunk_size is not None and look_back > 0 or look_back == -1:
             if cache is not None:
-                k_h_stride = k_h[:, :, : -(chunk_size[2]), :]
-                v_h_stride = v_h[:, :, : -(chunk_size[2]), :]
+                k_h_stride = k_h[:, :, :n_commit, :]
+                v_h_stride = v_h[:, :, :n_commit, :]
                 k_h = torch.cat((cache["k"], k_h), dim=2)
                 v_h = torch.cat((cache["v"], v_h), dim=2)
 
@@ -254,22 +361,86 @@ class MultiHeadedAttentionSANM(nn.Module):
                     cache["v"] = cache["v"][:, :, -(look_back * chunk_size[1]) :, :]
             else:
                 cache_tmp = {
-                    "k": k_h[:, :, : -(chunk_size[2]), :],
-                    "v": v_h[:, :, : -(chunk_size[2]), :],
+                    "k": k_h[:, :, :n_commit, :],
+                    "v": v_h[:, :, :n_commit, :],
                 }
                 cache = cache_tmp
-        fsmn_memory = self.forward_fsmn(v, None)
+            fsmn_memory, cache["fsmn"] = self.forward_fsmn_chunk(v, cache, n_commit)
+        else:
+            fsmn_memory = self.forward_fsmn(v, None)
         q_h = q_h * self.d_k ** (-0.5)
         scores = torch.matmul(q_h, k_h.transpose(-2, -1))
         att_outs = self.forward_attention(v_h, scores, None)
         return att_outs + fsmn_memory, cache
 
 
+class MultiHeadedAttentionSANMFused(MultiHeadedAttentionSANM):
+    """MultiHeadedAttentionSANM computed with fused kernels.
+
+    Same parameters and outputs as MultiHeadedAttentionSANM (selected with
+    ``selfattention_layer_type: sanm_sdpa``), but q/k/v are strided views of
+    the ``linear_q_k_v`` output, attention runs in
+    ``F.scaled_dot_product_attention`` and the FSMN branch stays in the
+    (#batch, size, time) layout with the padding done inside the convolution.
+
+    """
+
+    def forward_fsmn(self, inputs, mask, mask_shfit_chunk=None):
+        b, t, d = inputs.size()
+        x = inputs.transpose(1, 2)  # (batch, size, time), no copy
+        if mask is not None:
+            mask = torch.reshape(mask, (b, 1, -1))
+            if mask_shfit_chunk is not None:
+                mask = mask * mask_shfit_chunk.transpose(1, 2)
+            x = x * mask
+
+        left_padding, right_padding = self.pad_fn.padding
+        if left_padding == right_padding:
+            y = F.conv1d(x, self.fsmn_block.weight, padding=left_padding, groups=d)
+        else:
+            y = F.conv1d(F.pad(x, (left_padding, right_padding)), self.fsmn_block.weight, groups=d)
+        y = self.dropout(y.add_(x))
+        if mask is not None:
+            y = y * mask
+        return y.transpose(1, 2)
+
+    def forward(self, x, mask, mask_shfit_chunk=None, mask_att_chunk_encoder=None):
+        """Compute scaled dot product attention.
+
+        Args:
+            x (torch.Tensor): Input tensor (#batch, time, size).
+            mask (torch.Tensor): Mask tensor (#batch, 1, time).
+
+        Returns:
+            torch.Tensor: Output tensor (#batch, time, d_model).
+
+        """
+        b, t, _ = x.size()
+        q_k_v = self.linear_q_k_v(x)
+        q_h, k_h, v_h = q_k_v.view(b, t, 3, self.h, self.d_k).permute(2, 0, 3, 1, 4)
+        fsmn_memory = self.forward_fsmn(q_k_v[..., 2 * self.h * self.d_k :], mask, mask_shfit_chunk)
+
+        attn_mask = None
+        if mask is not None:
+            if mask_att_chunk_encoder is not None:
+                mask = mask * mask_att_chunk_encoder
+            attn_mask = mask.unsqueeze(1).bool()  # (batch, 1, *, time2)
+        att = F.scaled_dot_product_attention(
+            q_h, k_h, v_h, attn_mask=attn_mask, dropout_p=self.dropout.p if self.training else 0.0
+        )
+        att = att.transpose(1, 2).reshape(b, t, self.h * self.d_k)
+        return self.linear_out(att).add_(fsmn_memory)
+
+
 class LayerNorm(nn.LayerNorm):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
     def forward(self, input):
+        if self.weight is None or input.dtype == self.weight.dtype:
+            # same precision throughout: no casts, the half/bfloat16 CPU kernels
+            # already accumulate mean and variance in float32
+            return F.layer_norm(input, self.normalized_shape, self.weight, self.bias, self.eps)
         output = F.layer_norm(
             input.float(),
             self.normalized_shape,
@@ -291,6 +462,40 @@ def sequence_mask(lengths, maxlen=None, dtype=torch.float32, device=None):
     return mask.type(dtype).to(device) if device is not None else mask.type(dtype)
 
 
+class SequencePacking:
+    """Layout of a padded batch packed into one padding-free sequence.
+
+    The valid frames of all utterances are concatenated into (1, total_time, size),
+    so the linear layers never see padded frames; attention and the FSMN memory
+    use ``lengths`` / ``fsmn_index`` to stay within each utterance.
+
+    Args:
+        lengths: (batch,) valid frames per utterance.
+        fsmn_padding: (left, right) padding of the FSMN convolution.
+    """
+
+    def __init__(self, lengths: torch.Tensor, fsmn_padding=(0, 0)):
+        self.lengths = lengths.tolist()
+        self.mask = sequence_mask(lengths, device=lengths.device).bool()
+        gap = max(fsmn_padding)
+        segment = torch.repeat_interleave(
+            torch.arange(len(self.lengths), device=lengths.device), lengths
+        )
+        # positions of the packed frames in the zero-gapped FSMN buffer
+        self.fsmn_index = torch.arange(segment.numel(), device=lengths.device) + segment * gap
+        self.fsmn_size = segment.numel() + gap * (len(self.lengths) - 1)
+
+    def pack(self, xs_pad: torch.Tensor) -> torch.Tensor:
+        """(batch, time, size) -> (1, total_time, size)"""
+        return xs_pad[self.mask].unsqueeze(0)
+
+    def unpack(self, x: torch.Tensor) -> torch.Tensor:
+        """(1, total_time, size) -> (batch, time, size), zeros in the padding"""
+        xs_pad = x.new_zeros(self.mask.shape + x.shape[2:])
+        xs_pad[self.mask] = x[0]
+        return xs_pad
+
+
 class EncoderLayerSANM(nn.Module):
     def __init__(
         self,
@@ -397,6 +602,38 @@ class EncoderLayerSANM(nn.Module):
 
         return x, mask, cache, mask_shfit_chunk, mask_att_chunk_encoder
 
+    def forward_packed(self, x, packing):
+        """Compute encoded features of a packed batch.
+
+        Args:
+            x (torch.Tensor): Packed input tensor (1, total_time, size).
+            packing (SequencePacking): Layout of the packed batch.
+
+        Returns:
+            torch.Tensor: Output tensor (1, total_time, size).
+
+        """
+        residual = x
+        if self.normalize_before:
+            x = self.norm1(x)
+
+        if self.in_size == self.size:
+            x = residual + self.self_attn.forward_packed(x, packing)
+        else:
+            x = self.self_attn.forward_packed(x, packing)
+
+        if not self.normalize_before:
+            x = self.norm1(x)
+
+        residual = x
+        if self.normalize_before:
+            x = self.norm2(x)
+        x = residual + self.feed_forward(x)
+        if not self.normalize_before:
+            x = self.norm2(x)
+
+        return x
+
     def forward_chunk(self, x, cache=None, chunk_size=None, look_back=0):
         """Compute encoded features.
 
@@ -480,7 +717,12 @@ class SenseVoiceEncoderSmall(nn.Module):
             dropout_rate,
         )
 
-        encoder_selfattn_layer = MultiHeadedAttentionSANM
+        if selfattention_layer_type == "sanm":
+            encoder_selfattn_layer = MultiHeadedAttentionSANM
+        elif selfattention_layer_type == "sanm_sdpa":
+            encoder_selfattn_layer = MultiHeadedAttentionSANMFused
+        else:
+            raise ValueError("unknown selfattention_layer_type: " + selfattention_layer_type)
         encoder_selfattn_layer_args0 = (
             attention_heads,
             input_size,
@@ -540,18 +782,43 @@ class SenseVoiceEncoderSmall(nn.Module):
 
         self.tp_norm = LayerNorm(output_size)
 
+        # per-dim input affine replacing the sqrt(d) scaling once CMVN is folded in
+        self.register_buffer("input_scale", None, persistent=False)
+        self.register_buffer("input_shift", None, persistent=False)
+
     def output_size(self) -> int:
         return self._output_size
 
+    def fold_input_affine(self, scale: torch.Tensor, shift: torch.Tensor):
+        """Replace the input scaling ``x * sqrt(d)`` with ``x * scale + shift``."""
+        self.input_scale = scale.to(self.after_norm.weight)
+        self.input_shift = shift.to(self.after_norm.weight)
+
+    def scale_input(self, xs_pad: torch.Tensor) -> torch.Tensor:
+        if self.input_scale is not None:
+            return torch.addcmul(self.input_shift, xs_pad, self.input_scale)
+        return xs_pad * self.output_size() ** 0.5
+
     def forward(
         self,
         xs_pad: torch.Tensor,
         ilens: torch.Tensor,
+        tp_blocks: int = None,
+        exit_blocks: tuple = (),
+        exit_fn=None,
     ):
-        """Embed positions in tensor."""
-        masks = sequence_mask(ilens, device=ilens.device)[:, None, :]
+        """Embed positions in tensor.
+
+        Args:
+            tp_blocks: run only the first ``tp_blocks`` tp_encoders (fast mode),
+                None for all of them.
+            exit_blocks: tp block counts after which ``exit_fn`` is consulted.
+            exit_fn: ``exit_fn(encoder_out, olens) -> bool``, called with the
+                tp_norm-ed output at ``exit_blocks``; True stops the encoder there.
+        """
+        masks = sequence_mask(ilens, dtype=xs_pad.dtype, device=ilens.device)[:, None, :]
 
-        xs_pad *= self.output_size() ** 0.5
+        xs_pad = self.scale_input(xs_pad)
 
         xs_pad = self.embed(xs_pad)
 
@@ -569,13 +836,227 @@ class SenseVoiceEncoderSmall(nn.Module):
         # forward encoder2
         olens = masks.squeeze(1).sum(1).int()
 
-        for layer_idx, encoder_layer in enumerate(self.tp_encoders):
+        tp_encoders = self.tp_encoders if tp_blocks is None else self.tp_encoders[:tp_blocks]
+        for layer_idx, encoder_layer in enumerate(tp_encoders):
             encoder_outs = encoder_layer(xs_pad, masks)
             xs_pad, masks = encoder_outs[0], encoder_outs[1]
+            if exit_fn is not None and layer_idx + 1 < len(tp_encoders) and layer_idx + 1 in exit_blocks:
+                encoder_out = self.tp_norm(xs_pad)
+                if exit_fn(encoder_out, olens):
+                    return encoder_out, olens
 
         xs_pad = self.tp_norm(xs_pad)
         return xs_pad, olens
 
+    def forward_packed(
+        self,
+        xs_pad: torch.Tensor,
+        ilens: torch.Tensor,
+        tp_blocks: int = None,
+        exit_blocks: tuple = (),
+        exit_fn=None,
+    ):
+        """Same as forward, but the batch is packed so padded frames are never computed.
+
+        Worth it for batches mixing short and long utterances; the outputs match
+        forward on the valid frames and are zero in the padding.
+        """
+        packing = SequencePacking(ilens, self.encoders0[0].self_attn.pad_fn.padding)
+        olens = ilens.int()
+
+        xs_pad = self.scale_input(xs_pad)
+        xs_pad = self.embed(xs_pad)
+        xs = packing.pack(xs_pad)
+
+        for encoder_layer in list(self.encoders0) + list(self.encoders):
+            xs = encoder_layer.forward_packed(xs, packing)
+
+        xs = self.after_norm(xs)
+
+        tp_encoders = self.tp_encoders if tp_blocks is None else self.tp_encoders[:tp_blocks]
+        for layer_idx, encoder_layer in enumerate(tp_encoders):
+            xs = encoder_layer.forward_packed(xs, packing)
+            if exit_fn is not None and layer_idx + 1 < len(tp_encoders) and layer_idx + 1 in exit_blocks:
+                encoder_out = packing.unpack(self.tp_norm(xs))
+                if exit_fn(encoder_out, olens):
+                    return encoder_out, olens
+
+        return packing.unpack(self.tp_norm(xs)), olens
+
+    def forward_chunk(
+        self,
+        xs_pad: torch.Tensor,
+        cache: dict,
+        chunk_size: list = (0, 10, 5),
+        look_back: int = -1,
+        tp_blocks: int = None,
+    ):
+        """Encode one streaming chunk.
+
+        Args:
+            xs_pad: (1, time, dim) features of the chunk, the last ``chunk_size[2]``
+                frames are lookahead and are fed again at the start of the next chunk.
+            cache: per-utterance streaming state, an empty dict for the first chunk.
+                Holds the position offset and the key/value/FSMN caches of every
+                layer (encoders0, encoders and tp_encoders), updated in place.
+            chunk_size: [left, chunk, lookahead] in frames.
+            look_back: number of past chunks kept in the attention cache, -1 for all.
+            tp_blocks: run only the first ``tp_blocks`` tp_encoders, must stay the
+                same for all chunks of an utterance.
+
+        Returns:
+            torch.Tensor: encoded chunk (1, time, output_size), lookahead frames included.
+        """
+        start_idx = cache.get("start_idx", 0)
+        tp_encoders = self.tp_encoders if tp_blocks is None else self.tp_encoders[:tp_blocks]
+        layers = list(self.encoders0) + list(self.encoders) + list(tp_encoders)
+        layer_caches = cache.setdefault("layers", [None] * len(layers))
+
+        xs_pad = self.scale_input(xs_pad)
+        xs_pad = self.embed(xs_pad, start_idx=start_idx)
+
+        n_main = len(self.encoders0) + len(self.encoders)
+        for layer_idx, encoder_layer in enumerate(layers):
+            if layer_idx == n_main:
+                xs_pad = self.after_norm(xs_pad)
+            xs_pad, layer_caches[layer_idx] = encoder_layer.forward_chunk(
+                xs_pad, layer_caches[layer_idx], chunk_size, look_back
+            )
+
+        xs_pad = self.tp_norm(xs_pad)
+        cache["start_idx"] = start_idx + xs_pad.size(1) - chunk_size[2]
+        return xs_pad
+
+
+class OnlineFeatures:
+    """Incremental frontend for inference_chunk: resample -> fbank -> LFR -> CMVN.
+
+    Each stage keeps only the tail it still needs (the resampler's filter context,
+    the samples of the first incomplete fbank frame, the fbank frames the next LFR
+    frame stacks), so a call costs time proportional to the new audio rather than
+    to the whole utterance. Frames are emitted once no later audio can change them;
+    the output equals the offline frontend's apart from float rounding (and dither).
+
+    Resampling uses the windowed-sinc kernel of ``torchaudio.transforms.Resample``
+    (hann window, 6 zero crossings, rolloff 0.99) evaluated block by block.
+    """
+
+    def __init__(self, frontend, audio_fs: int = 16000, lowpass_filter_width: int = 6, rolloff: float = 0.99):
+        self.frontend = frontend
+        fs = int(frontend.fs)
+        gcd = math.gcd(int(audio_fs), fs)
+        self.orig, self.new = int(audio_fs) // gcd, fs // gcd
+        self.kernel = None
+        if self.orig != self.new:
+            base = min(self.orig, self.new) * rolloff
+            self.width = math.ceil(lowpass_filter_width * self.orig / base)
+            idx = torch.arange(-self.width, self.width + self.orig, dtype=torch.float64) / self.orig
+            t = torch.arange(0, -self.new, -1, dtype=torch.float64)[:, None] / self.new + idx[None]
+            t = (t * base).clamp_(-lowpass_filter_width, lowpass_filter_width)
+            window = torch.cos(t * math.pi / lowpass_filter_width / 2) ** 2
+            t = t * math.pi
+            kernel = torch.where(t == 0, torch.ones_like(t), t.sin() / t) * window * (base / self.orig)
+            self.kernel = kernel.float()[:, None, :]
+            # the signal is zero-padded by `width` on the left, like the offline resampler
+            self.pcm = torch.zeros(self.width)
+            self.n_in = 0
+            self.n_blocks = 0
+
+        self.frame_length = int(fs * frontend.frame_length / 1000)
+        self.frame_shift = int(fs * frontend.frame_shift / 1000)
+        self.wav = torch.zeros(0)
+        self.feats = None  # fbank frames from index feats_start on
+        self.feats_start = 0
+        self.n_fbank = 0
+        self.n_lfr = 0
+
+    def resample(self, audio: torch.Tensor, is_final: bool) -> torch.Tensor:
+        if self.kernel is None:
+            return audio
+        self.n_in += audio.numel()
+        pcm = torch.cat((self.pcm, audio.float()))
+        if is_final:
+            pcm = torch.cat((pcm, pcm.new_zeros(self.width + self.orig)))
+            n_out = math.ceil(self.new * self.n_in / self.orig)
+            n_blocks = -(-n_out // self.new) - self.n_blocks
+        else:
+            # block b needs input up to b * orig + width + orig
+            n_blocks = (pcm.numel() - 2 * self.width) // self.orig
+        if n_blocks <= 0:
+            self.pcm = pcm
+            return pcm.new_zeros(0)
+        out = F.conv1d(pcm[None, None, : n_blocks * self.orig + 2 * self.width], self.kernel, stride=self.orig)
+        out = out[0].t().reshape(-1)
+        if is_final:
+            out = out[: n_out - self.n_blocks * self.new]
+        self.pcm = pcm[n_blocks * self.orig :]
+        self.n_blocks += n_blocks
+        return out
+
+    def fbank(self, wav: torch.Tensor) -> torch.Tensor:
+        wav = torch.cat((self.wav, wav))
+        n = 0 if wav.numel() < self.frame_length else 1 + (wav.numel() - self.frame_length) // self.frame_shift
+        if n == 0:
+            self.wav = wav
+            return wav.new_zeros(0, self.frontend.n_mels)
+        used = (n - 1) * self.frame_shift + self.frame_length
+        feats, _ = self.frontend.forward_fbank(wav[None, :used], torch.tensor([used]))
+        self.wav = wav[n * self.frame_shift :]
+        return feats[0]
+
+    def __call__(self, audio: torch.Tensor, is_final: bool = False) -> torch.Tensor:
+        """New audio at ``audio_fs`` -> the (n, lfr_m * n_mels) LFR frames that became final."""
+        feats = self.fbank(self.resample(audio, is_final))
+        if feats.size(0):
+            self.feats = feats if self.feats is None else torch.cat((self.feats, feats))
+            self.n_fbank += feats.size(0)
+        if self.feats is None:
+            return torch.zeros(0, self.frontend.lfr_m * self.frontend.n_mels)
+
+        lfr_m, lfr_n = self.frontend.lfr_m, self.frontend.lfr_n
+        left = (lfr_m - 1) // 2
+        if is_final:
+            n_lfr = -(-self.n_fbank // lfr_n)
+        else:
+            # LFR frame i stacks fbank frames i * lfr_n - left ... i * lfr_n - left + lfr_m - 1
+            n_lfr = max(0, (self.n_fbank - lfr_m + left) // lfr_n + 1)
+        if n_lfr <= self.n_lfr:
+            return self.feats.new_zeros(0, lfr_m * self.feats.size(1))
+
+        # the first frame repeats on the left, the last one on the right
+        rows = torch.arange(self.n_lfr, n_lfr)[:, None] * lfr_n - left + torch.arange(lfr_m)[None]
+        rows = rows.clamp(0, self.n_fbank - 1) - self.feats_start
+        lfr = self.feats[rows.reshape(-1)].reshape(n_lfr - self.n_lfr, -1)
+        self.n_lfr = n_lfr
+        keep = max(0, n_lfr * lfr_n - left - self.feats_start)
+        self.feats, self.feats_start = self.feats[keep:], self.feats_start + keep
+
+        cmvn = getattr(self.frontend, "cmvn", None)
+        if cmvn is not None:
+            cmvn = torch.as_tensor(cmvn, dtype=lfr.dtype)
+            lfr = (lfr + cmvn[0, : lfr.size(1)]) * cmvn[1, : lfr.size(1)]
+        return lfr
+
+
+class EncoderCTC(nn.Module):
+    """Encoder followed by the CTC log-softmax, the part of inference traced by compile_encoder."""
+
+    def __init__(self, encoder: nn.Module, ctc: nn.Module):
+        super().__init__()
+        self.encoder = encoder
+        self.ctc = ctc
+
+    def forward(self, speech: torch.Tensor, speech_lengths: torch.Tensor):
+        encoder_out, encoder_out_lens = self.encoder(speech, speech_lengths)
+        return self.ctc.log_softmax(encoder_out), encoder_out_lens
+
+
+def _module_attr(module, name: str):
+    *path, attr = name.split(".")
+    for part in path:
+        module = getattr(module, part)
+    return module, attr
+
 
 @tables.register("model_classes", "SenseVoiceSmall")
 class SenseVoiceSmall(nn.Module):
@@ -819,7 +1300,7 @@ class SenseVoiceSmall(nn.Module):
                 speech_lengths.sum().item() * frontend.frame_shift * frontend.lfr_n / 1000
             )
 
-        speech = speech.to(device=kwargs["device"])
+        speech = speech.to(device=kwargs["device"], dtype=self.embed.weight.dtype)
         speech_lengths = speech_lengths.to(device=kwargs["device"])
 
         language = kwargs.get("language", "auto")
@@ -848,35 +1329,72 @@ class SenseVoiceSmall(nn.Module):
         speech = torch.cat((input_query, speech), dim=1)
         speech_lengths += 3
 
-        # Encoder
-        encoder_out, encoder_out_lens = self.encoder(speech, speech_lengths)
-        if isinstance(encoder_out, tuple):
-            encoder_out = encoder_out[0]
+        # Encoder, optionally in fast mode: fewer tp blocks and/or CTC-confidence early exit
+        exit_threshold = kwargs.get("exit_threshold", None)
+        probe = {}
+
+        def exit_fn(encoder_out, encoder_out_lens):
+            probe["encoder_out"] = encoder_out
+            probe["ctc_logits"] = self.ctc.log_softmax(encoder_out)
+            confidence = self.ctc_confidence(probe["ctc_logits"], encoder_out_lens)
+            return bool((confidence >= exit_threshold).all())
+
+        compiled = self.__dict__.get("_compiled_encoder")
+        fast_mode = (
+            kwargs.get("tp_blocks", None) is not None
+            or exit_threshold is not None
+            or kwargs.get("packed_encoder", False) and speech.size(0) > 1
+        )
+        if compiled is not None and not fast_mode:
+            # c. Encoder and CTC head as one frozen TorchScript graph (see compile_encoder)
+            ctc_logits, encoder_out_lens = compiled(speech, speech_lengths)
+        else:
+            encoder = self.encoder
+            if kwargs.get("packed_encoder", False) and speech.size(0) > 1:
+                encoder = self.encoder.forward_packed  # mixed lengths: skip the padded frames
+            encoder_out, encoder_out_lens = encoder(
+                speech,
+                speech_lengths,
+                tp_blocks=kwargs.get("tp_blocks", None),
+                exit_blocks=kwargs.get("exit_blocks", (10,)),
+                exit_fn=exit_fn if exit_threshold is not None else None,
+            )
+            if isinstance(encoder_out, tuple):
+                encoder_out = encoder_out[0]
 
-        # c. Passed the encoder result and the beam search
-        ctc_logits = self.ctc.log_softmax(encoder_out)
+            # c. Passed the encoder result and the beam search
+            if probe.get("encoder_out") is encoder_out:
+                ctc_logits = probe["ctc_logits"]  # exited early, reuse the probe
+            else:
+                ctc_logits = self.ctc.log_softmax(encoder_out)
+        if output_timestamp:
+            probs = ctc_logits.exp()
         if kwargs.get("ban_emo_unk", False):
             ctc_logits[:, :, self.emo_dict["unk"]] = -float("inf")
 
         results = []
-        b, n, d = encoder_out.size()
+        b, n = ctc_logits.shape[:2]
         if isinstance(key[0], (list, tuple)):
             key = key[0]
         if len(key) < b:
             key = key * b
-        for i in range(b):
-            x = ctc_logits[i, : encoder_out_lens[i].item(), :]
-            yseq = x.argmax(dim=-1)
-            yseq = torch.unique_consecutive(yseq, dim=-1)
 
-            ibest_writer = None
-            if kwargs.get("output_dir") is not None:
-                if not hasattr(self, "writer"):
-                    self.writer = DatadirWriter(kwargs.get("output_dir"))
-                ibest_writer = self.writer[f"1best_recog"]
+        # greedy CTC for the whole padded batch: argmax, collapse repeats, drop blanks and padding
+        yseq = ctc_logits.argmax(dim=-1)
+        keep = torch.arange(n, device=yseq.device)[None, :] < encoder_out_lens[:, None]
+        keep &= yseq != self.blank_id
+        keep[:, 1:] &= yseq[:, 1:] != yseq[:, :-1]
+        yseq, keep = yseq.cpu().numpy(), keep.cpu().numpy()
+        token_ints = [row[mask].tolist() for row, mask in zip(yseq, keep)]
+
+        ibest_writer = None
+        if kwargs.get("output_dir") is not None:
+            if not hasattr(self, "writer"):
+                self.writer = DatadirWriter(kwargs.get("output_dir"))
+            ibest_writer = self.writer[f"1best_recog"]
 
-            mask = yseq != self.blank_id
-            token_int = yseq[mask].tolist()
+        for i in range(b):
+            token_int = token_ints[i]
 
             # Change integer-ids to tokens
             text = tokenizer.decode(token_int)
@@ -888,7 +1406,7 @@ class SenseVoiceSmall(nn.Module):
                 timestamp = []
                 tokens = tokenizer.text2tokens(text)[4:]
 
-                logits_speech = self.ctc.softmax(encoder_out)[i, 4:encoder_out_lens[i].item(), :]
+                logits_speech = probs[i, 4:encoder_out_lens[i].item(), :]
 
                 pred = logits_speech.argmax(-1).cpu()
                 logits_speech[pred==self.blank_id, self.blank_id] = 0
@@ -921,6 +1439,264 @@ class SenseVoiceSmall(nn.Module):
                 results.append(result_i)
         return results, meta_data
 
+    def ctc_confidence(self, ctc_logits: torch.Tensor, lengths: torch.Tensor) -> torch.Tensor:
+        """Per-utterance CTC confidence used for early exit.
+
+        The lowest greedy posterior among the non-blank frames, i.e. how sure the
+        model is about its least certain emitted token; 1.0 if nothing is emitted.
+
+        Args:
+            ctc_logits: (batch, time, vocab) CTC log posteriors.
+            lengths: (batch,) valid frames.
+
+        Returns:
+            torch.Tensor: (batch,) confidences in [0, 1].
+        """
+        best, ids = ctc_logits.max(dim=-1)
+        valid = torch.arange(best.size(1), device=best.device)[None, :] < lengths[:, None]
+        valid &= ids != self.blank_id
+        return best.masked_fill(~valid, 0.0).min(dim=1).values.exp()
+
+    def to_precision(self, dtype="bfloat16"):
+        """Run the whole model in reduced precision (``"bfloat16"`` or ``"float16"``).
+
+        Features are cast to the model dtype on entry, so activations stay in that
+        precision end-to-end. Use bfloat16 on CPUs with native support (e.g. AVX512-BF16,
+        AMX, Armv8.6 BF16); not combinable with ``quantize()``.
+        """
+        if isinstance(dtype, str):
+            dtype = getattr(torch, dtype)
+        return self.to(dtype=dtype)
+
+    def quantize(self, dtype: torch.dtype = torch.qint8):
+        """Dynamic INT8 quantization of every nn.Linear for CPU inference.
+
+        Covers linear_q_k_v / linear_out of the attention, w_1 / w_2 of the
+        feed-forward in all encoder layers and the CTC output projection. Weights
+        are stored as int8, activations are quantized on the fly per batch; the
+        LayerNorms, FSMN convolutions and embeddings stay in float32.
+        """
+        if platform.machine().lower() in ("aarch64", "arm64", "armv7l"):
+            if "qnnpack" in torch.backends.quantized.supported_engines:
+                torch.backends.quantized.engine = "qnnpack"
+        torch.ao.quantization.quantize_dynamic(self, {nn.Linear}, dtype=dtype, inplace=True)
+        return self
+
+    def fold_cmvn(self, frontend) -> bool:
+        """Fold the frontend CMVN into the encoder input scaling.
+
+        CMVN ``(x + mean) * var`` is followed by the encoder's ``x * sqrt(d)``, so the
+        two merge into one per-dim ``x * scale + shift`` that costs the same as the
+        scaling alone. The query embeddings (language, event/emotion, text norm) are
+        not normalized but share that scaling, so they are pre-compensated to keep
+        their encoder input unchanged. Afterwards ``frontend.cmvn`` is cleared.
+
+        Returns:
+            bool: False if the frontend has no CMVN to fold.
+        """
+        cmvn = getattr(frontend, "cmvn", None)
+        if cmvn is None or self.encoder.input_scale is not None:
+            return False
+        cmvn = torch.as_tensor(cmvn, dtype=torch.float64)
+        means, vars = cmvn[0], cmvn[1]
+
+        scale0 = self.encoder.output_size() ** 0.5
+        scale = vars * scale0
+        shift = means * vars * scale0
+        with torch.no_grad():
+            weight = self.embed.weight.double()
+            self.embed.weight.copy_((weight * scale0 - shift) / scale)
+        self.encoder.fold_input_affine(scale, shift)
+        frontend.cmvn = None
+        return True
+
+    def compile_encoder(self, cache_dir: str = None) -> bool:
+        """Trace the encoder and CTC head with TorchScript and run inference through the frozen graph.
+
+        The traced graph is saved to ``cache_dir`` without its weights, keyed by the
+        torch version, device, model variant (dtype, attention implementation,
+        quantization, folded CMVN) and the names and shapes of all weights, so later
+        startups load it instead of tracing again. Weights are always this model's
+        own parameters, buffers and INT8 packed Linear params, rebound into the graph
+        before freezing, so checkpoints with the same architecture share one graph.
+        Fast-mode, packed and streaming inference keep using the eager modules.
+
+        Call it after fold_cmvn / quantize / to_precision.
+
+        Returns:
+            bool: True if the graph was loaded from the cache.
+        """
+        device = self.embed.weight.device
+        module = EncoderCTC(self.encoder, self.ctc).eval()
+        weights = dict(module.named_parameters())
+        weights.update(module.named_buffers())
+        # dynamically quantized Linears keep weight and bias in a packed object, not in parameters
+        weights.update(
+            (f"{name}._packed_params", m._packed_params)
+            for name, m in module.named_modules()
+            if isinstance(getattr(m, "_packed_params", None), torch.ScriptObject)
+        )
+
+        key = [torch.__version__, str(device), str(self.embed.weight.dtype)]
+        key += sorted({f"{type(m).__module__}.{type(m).__name__}" for m in module.modules()})
+        key.append(str(self.encoder.input_scale is not None))
+        # the graph is specialised to the layer count and sizes, not to the weight values
+        for name, value in weights.items():
+            if isinstance(value, torch.ScriptObject):
+                value = torch.ops.quantized.linear_unpack(value)[0]
+            key.append(f"{name}{tuple(value.shape)}")
+        key = hashlib.sha1("|".join(key).encode()).hexdigest()[:16]
+        path = os.path.join(cache_dir, f"encoder_ctc_{key}.ts") if cache_dir else None
+
+        loaded = path is not None and os.path.exists(path)
+        if loaded:
+            traced = torch.jit.load(path, map_location=device)
+        else:
+            speech = torch.randn(2, 64, self.encoder.encoders0[0].in_size, device=device)
+            speech_lengths = torch.tensor([64, 40], device=device)
+            with torch.no_grad():
+                traced = torch.jit.trace(
+                    module, (speech.to(self.embed.weight.dtype), speech_lengths), check_trace=False
+                )
+            if path is not None:
+                for name, value in weights.items():
+                    target, attr = _module_attr(traced, name)
+                    if isinstance(value, torch.ScriptObject):
+                        empty = torch.ops.quantized.linear_prepack(
+                            torch.quantize_per_tensor(torch.zeros(1, 1), 1.0, 0, torch.qint8), None
+                        )
+                    else:
+                        empty = value.new_empty(0)
+                        if isinstance(value, nn.Parameter):
+                            empty = nn.Parameter(empty, requires_grad=False)
+                    setattr(target, attr, empty)
+                try:
+                    os.makedirs(cache_dir, exist_ok=True)
+                    torch.jit.save(traced, path + ".tmp")
+                    os.replace(path + ".tmp", path)
+                except OSError as e:
+                    logging.warning(f"failed to save the compiled encoder to {path}: {e}")
+
+        for name, value in weights.items():
+            target, attr = _module_attr(traced, name)
+            setattr(target, attr, value)
+        self.__dict__["_compiled_encoder"] = torch.jit.freeze(traced.eval())
+        return loaded
+
+    def inference_chunk(
+        self,
+        data_in,
+        cache: dict,
+        is_final: bool = False,
+        key: list = ["wav_file_tmp_name"],
+        tokenizer=None,
+        frontend=None,
+        chunk_size: list = (0, 10, 5),
+        look_back: int = -1,
+        **kwargs,
+    ):
+        """Streaming inference, batch size 1.
+
+        Feed newly captured audio as it arrives; features are extracted
+        incrementally (OnlineFeatures), the encoder runs chunk by chunk with
+        per-layer caches and a partial CTC hypothesis is returned after every
+        call, so the final result only needs the last chunk when speech ends.
+
+        Args:
+            data_in: new audio samples (1-D numpy array or tensor) at ``fs``.
+            cache: an empty dict at the start of an utterance, updated in place
+                and cleared again after the final chunk.
+            is_final: flush the remaining frames (end of speech).
+            chunk_size: [left, chunk, lookahead] in LFR frames (60 ms each).
+            look_back: number of past chunks attended to, -1 for all.
+        """
+        meta_data = {}
+        device = kwargs["device"]
+
+        # 1. features of the new audio only; frames still waiting for their
+        #    lookahead are kept in the cache and re-fed next time
+        if not isinstance(data_in, torch.Tensor):
+            data_in = torch.as_tensor(data_in, dtype=torch.float32)
+        time1 = time.perf_counter()
+        if "frontend" not in cache:
+            cache["frontend"] = OnlineFeatures(frontend, kwargs.get("fs", 16000))
+        speech = cache["frontend"](data_in.reshape(-1), is_final)
+        speech = speech.to(device=device, dtype=self.embed.weight.dtype)[None]
+        if "speech" in cache:
+            speech = torch.cat((cache["speech"], speech), dim=1)
+        time2 = time.perf_counter()
+        meta_data["extract_feat"] = f"{time2 - time1:0.3f}"
+
+        # 2. encode every complete chunk
+        encoder_cache = cache.setdefault("encoder", {})
+        n_frames = speech.size(1)
+        n_fed = 0
+        step = chunk_size[1]
+        lookahead = chunk_size[2]
+        outputs = []
+        while n_fed < n_frames:
+            if n_frames - n_fed >= step + lookahead:
+                n_commit, n_lookahead = step, lookahead
+            elif is_final:
+                n_commit, n_lookahead = n_frames - n_fed, 0
+            else:
+                break
+            xs = speech[:, n_fed : n_fed + n_commit + n_lookahead, :]
+            n_fed += n_commit
+
+            if not encoder_cache:
+                xs = torch.cat((self._query_embedding(xs, **kwargs), xs), dim=1)
+                n_commit += 4
+            encoder_out = self.encoder.forward_chunk(
+                xs,
+                encoder_cache,
+                [chunk_size[0], step, n_lookahead],
+                look_back,
+                tp_blocks=kwargs.get("tp_blocks", None),
+            )
+            outputs.append(encoder_out[:, :n_commit, :])
+        cache["speech"] = speech[:, n_fed:]
+        meta_data["encoder"] = f"{time.perf_counter() - time2:0.3f}"
+
+        # 3. greedy CTC on the committed frames, collapsing across chunk borders
+        token_int = cache.setdefault("tokens", [])
+        if outputs:
+            ctc_logits = self.ctc.log_softmax(torch.cat(outputs, dim=1))
+            if kwargs.get("ban_emo_unk", False):
+                ctc_logits[:, :, self.emo_dict["unk"]] = -float("inf")
+            prev = cache.get("last_id", self.blank_id)
+            for token in ctc_logits[0].argmax(dim=-1).tolist():
+                if token != prev and token != self.blank_id:
+                    token_int.append(token)
+                prev = token
+            cache["last_id"] = prev
+
+        text = tokenizer.decode(token_int)
+        if is_final:
+            cache.clear()
+        return [{"key": key[0], "text": text, "is_final": is_final}], meta_data
+
+    def _query_embedding(self, speech, **kwargs):
+        """Language, event/emotion and text-norm queries prepended to the features."""
+        language = kwargs.get("language", "auto")
+        language_query = self.embed(
+            torch.LongTensor(
+                [[self.lid_dict[language] if language in self.lid_dict else 0]]
+            ).to(speech.device)
+        ).repeat(speech.size(0), 1, 1)
+
+        textnorm = kwargs.get("text_norm", None)
+        if textnorm is None:
+            textnorm = "withitn" if kwargs.get("use_itn", False) else "woitn"
+        textnorm_query = self.embed(
+            torch.LongTensor([[self.textnorm_dict[textnorm]]]).to(speech.device)
+        ).repeat(speech.size(0), 1, 1)
+
+        event_emo_query = self.embed(torch.LongTensor([[1, 2]]).to(speech.device)).repeat(
+            speech.size(0), 1, 1
+        )
+        return torch.cat((language_query, event_emo_query, textnorm_query), dim=1)
+
     def export(self, **kwargs):
         from export_meta import export_rebuild_model
 
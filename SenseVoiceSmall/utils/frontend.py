@@ -2,15 +2,161 @@
 from pathlib import Path
 from typing import Any, Dict, Iterable, List, NamedTuple, Set, Tuple, Union
 import copy
+import os
 
 import numpy as np
-import kaldi_native_fbank as knf
 
 root_dir = Path(__file__).resolve().parent
 
 logger_initialized = {}
 
 
+class KaldiFbank:
+    """Batched Kaldi-compatible log-mel filterbank (snip_edges=True).
+
+    Produces the same features as ``kaldi_native_fbank.OnlineFbank`` configured like
+    ``WavFrontend``, but frames the whole waveform with a strided view and runs
+    the window, FFT and mel projection as matrix operations, so the feature
+    matrix comes back from one call instead of one ``get_frame`` per frame.
+    """
+
+    def __init__(
+        self,
+        fs: int = 16000,
+        window: str = "hamming",
+        n_mels: int = 80,
+        frame_length: int = 25,
+        frame_shift: int = 10,
+        dither: float = 1.0,
+        preemph_coeff: float = 0.97,
+        low_freq: float = 20.0,
+        high_freq: float = 0.0,
+    ) -> None:
+        self.fs = fs
+        self.n_mels = n_mels
+        self.dither = dither
+        self.preemph_coeff = preemph_coeff
+        self.frame_length = int(fs * frame_length / 1000)
+        self.frame_shift = int(fs * frame_shift / 1000)
+        self.n_fft = 1 << (self.frame_length - 1).bit_length()
+        self.window = self._window(window, self.frame_length)
+        self.mel_banks = self._mel_banks(fs, self.n_fft, n_mels, low_freq, high_freq)
+
+    @staticmethod
+    def _window(window_type: str, length: int) -> np.ndarray:
+        a = 2 * np.pi / (length - 1)
+        i = np.arange(length, dtype=np.float64)
+        if window_type == "hamming":
+            window = 0.54 - 0.46 * np.cos(a * i)
+        elif window_type == "hanning":
+            window = 0.5 - 0.5 * np.cos(a * i)
+        elif window_type == "povey":
+            window = np.power(0.5 - 0.5 * np.cos(a * i), 0.85)
+        elif window_type == "rectangular":
+            window = np.ones(length)
+        elif window_type == "sine":
+            window = np.sin(0.5 * a * i)
+        else:
+            raise ValueError(f"Invalid window type {window_type}")
+        return window.astype(np.float32)
+
+    @staticmethod
+    def _mel_banks(
+        fs: int, n_fft: int, n_mels: int, low_freq: float, high_freq: float
+    ) -> np.ndarray:
+        """(n_fft // 2 + 1, n_mels) triangular weights, the Nyquist bin is unused as in Kaldi."""
+        nyquist = 0.5 * fs
+        if high_freq <= 0.0:
+            high_freq += nyquist
+
+        def mel_scale(freq):
+            return 1127.0 * np.log(1.0 + freq / 700.0)
+
+        mel_low, mel_high = mel_scale(low_freq), mel_scale(high_freq)
+        mel_delta = (mel_high - mel_low) / (n_mels + 1)
+        left = mel_low + np.arange(n_mels) * mel_delta
+        center = left + mel_delta
+        right = center + mel_delta
+
+        mel = mel_scale(np.arange(n_fft // 2) * (fs / n_fft))[:, None]
+        up = (mel - left) / (center - left)
+        down = (right - mel) / (right - center)
+        weights = np.where(mel <= center, up, down)
+        weights = np.where((mel > left) & (mel < right), weights, 0.0)
+        banks = np.zeros((n_fft // 2 + 1, n_mels), dtype=np.float32)
+        banks[: n_fft // 2] = weights
+        return banks
+
+    def num_frames(self, num_samples: int) -> int:
+        if num_samples < self.frame_length:
+            return 0
+        return 1 + (num_samples - self.frame_length) // self.frame_shift
+
+    def __call__(self, waveform: np.ndarray) -> np.ndarray:
+        """Features of a 1-D waveform already scaled to the int16 range, (frames, n_mels) float32."""
+        waveform = np.ascontiguousarray(waveform, dtype=np.float32)
+        num_frames = self.num_frames(waveform.shape[0])
+        if num_frames == 0:
+            return np.empty((0, self.n_mels), dtype=np.float32)
+
+        stride = waveform.strides[0]
+        frames = np.lib.stride_tricks.as_strided(
+            waveform,
+            shape=(num_frames, self.frame_length),
+            strides=(self.frame_shift * stride, stride),
+            writeable=False,
+        ).copy()
+
+        if self.dither != 0.0:
+            frames += self.dither * np.random.standard_normal(frames.shape).astype(np.float32)
+        frames -= frames.mean(axis=1, keepdims=True)
+        if self.preemph_coeff != 0.0:
+            frames[:, 1:] -= self.preemph_coeff * frames[:, :-1]
+            frames[:, 0] *= 1.0 - self.preemph_coeff
+        frames *= self.window
+
+        spectrum = np.fft.rfft(frames, n=self.n_fft, axis=1)
+        power = np.square(spectrum.real, dtype=np.float32)
+        power += np.square(spectrum.imag, dtype=np.float32)
+        feat = power @ self.mel_banks
+        np.maximum(feat, np.finfo(np.float32).eps, out=feat)
+        np.log(feat, out=feat)
+        return feat
+
+
+def stack_lfr_frames(
+    inputs: np.ndarray, lfr_m: int, lfr_n: int, num_frames: int, left_padding: int = 0
+) -> np.ndarray:
+    """Stack ``num_frames`` LFR frames.
+
+    Frame i is padded[i * lfr_n : i * lfr_n + lfr_m] flattened, where ``padded`` is
+    ``inputs`` with its first frame repeated ``left_padding`` times in front and its
+    last frame repeated past the end. The padded input is built once and the frames
+    are returned as a read-only strided view of it: consecutive LFR frames overlap
+    in memory and nothing is copied.
+    """
+    T, dim = inputs.shape
+    if num_frames <= 0:
+        return np.empty((0, lfr_m * dim), dtype=np.float32)
+    inputs = inputs.astype(np.float32, copy=False)
+    right_padding = max(0, (num_frames - 1) * lfr_n + lfr_m - T - left_padding)
+    if left_padding or right_padding or not inputs.flags.c_contiguous:
+        padded = np.empty((left_padding + T + right_padding, dim), dtype=inputs.dtype)
+        padded[:left_padding] = inputs[0]
+        padded[left_padding : left_padding + T] = inputs
+        padded[left_padding + T :] = inputs[-1]
+        inputs = padded
+    itemsize = inputs.itemsize
+    LFR_outputs = np.lib.stride_tricks.as_strided(
+        inputs,
+        shape=(num_frames, lfr_m, dim),
+        strides=(lfr_n * dim * itemsize, dim * itemsize, itemsize),
+        writeable=False,
+    )
+    # each (lfr_m, dim) block is contiguous, so merging the last two axes stays a view
+    return LFR_outputs.reshape(num_frames, lfr_m * dim)
+
+
 class WavFrontend:
     """Conventional frontend structure for ASR."""
 
@@ -28,17 +174,14 @@ class WavFrontend:
         **kwargs,
     ) -> None:
 
-        opts = knf.FbankOptions()
-        opts.frame_opts.samp_freq = fs
-        opts.frame_opts.dither = dither
-        opts.frame_opts.window_type = window
-        opts.frame_opts.frame_shift_ms = float(frame_shift)
-        opts.frame_opts.frame_length_ms = float(frame_length)
-        opts.mel_opts.num_bins = n_mels
-        opts.energy_floor = 0
-        opts.frame_opts.snip_edges = True
-        opts.mel_opts.debug_mel = False
-        self.opts = opts
+        self.fbank_fn = KaldiFbank(
+            fs=fs,
+            window=window,
+            n_mels=n_mels,
+            frame_length=frame_length,
+            frame_shift=frame_shift,
+            dither=dither,
+        )
 
         self.lfr_m = lfr_m
         self.lfr_n = lfr_n
@@ -46,38 +189,27 @@ class WavFrontend:
 
         if self.cmvn_file:
             self.cmvn = self.load_cmvn()
-        self.fbank_fn = None
-        self.fbank_beg_idx = 0
         self.reset_status()
 
     def fbank(self, waveform: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
-        waveform = waveform * (1 << 15)
-        self.fbank_fn = knf.OnlineFbank(self.opts)
-        self.fbank_fn.accept_waveform(self.opts.frame_opts.samp_freq, waveform.tolist())
-        frames = self.fbank_fn.num_frames_ready
-        mat = np.empty([frames, self.opts.mel_opts.num_bins])
-        for i in range(frames):
-            mat[i, :] = self.fbank_fn.get_frame(i)
-        feat = mat.astype(np.float32)
-        feat_len = np.array(mat.shape[0]).astype(np.int32)
+        feat = self.fbank_fn(np.asarray(waveform, dtype=np.float32) * (1 << 15))
+        feat_len = np.array(feat.shape[0]).astype(np.int32)
         return feat, feat_len
 
     def fbank_online(self, waveform: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
-        waveform = waveform * (1 << 15)
-        # self.fbank_fn = knf.OnlineFbank(self.opts)
-        self.fbank_fn.accept_waveform(self.opts.frame_opts.samp_freq, waveform.tolist())
-        frames = self.fbank_fn.num_frames_ready
-        mat = np.empty([frames, self.opts.mel_opts.num_bins])
-        for i in range(self.fbank_beg_idx, frames):
-            mat[i, :] = self.fbank_fn.get_frame(i)
-        # self.fbank_beg_idx += (frames-self.fbank_beg_idx)
-        feat = mat.astype(np.float32)
-        feat_len = np.array(mat.shape[0]).astype(np.int32)
-        return feat, feat_len
+        """Accumulating fbank: returns the features of all audio since reset_status()."""
+        waveform = np.asarray(waveform, dtype=np.float32) * (1 << 15)
+        waveform = np.concatenate((self.fbank_waveform, waveform))
+        feat = self.fbank_fn(waveform)
+        # keep the samples from the first incomplete frame on for the next call
+        self.fbank_waveform = waveform[feat.shape[0] * self.fbank_fn.frame_shift :]
+        self.fbank_feats = np.concatenate((self.fbank_feats, feat))
+        feat_len = np.array(self.fbank_feats.shape[0]).astype(np.int32)
+        return self.fbank_feats, feat_len
 
     def reset_status(self):
-        self.fbank_fn = knf.OnlineFbank(self.opts)
-        self.fbank_beg_idx = 0
+        self.fbank_waveform = np.empty(0, dtype=np.float32)
+        self.fbank_feats = np.empty((0, self.fbank_fn.n_mels), dtype=np.float32)
 
     def lfr_cmvn(self, feat: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
         if self.lfr_m != 1 or self.lfr_n != 1:
@@ -91,41 +223,42 @@ class WavFrontend:
 
     @staticmethod
     def apply_lfr(inputs: np.ndarray, lfr_m: int, lfr_n: int) -> np.ndarray:
-        LFR_inputs = []
-
         T = inputs.shape[0]
         T_lfr = int(np.ceil(T / lfr_n))
-        left_padding = np.tile(inputs[0], ((lfr_m - 1) // 2, 1))
-        inputs = np.vstack((left_padding, inputs))
-        T = T + (lfr_m - 1) // 2
-        for i in range(T_lfr):
-            if lfr_m <= T - i * lfr_n:
-                LFR_inputs.append((inputs[i * lfr_n : i * lfr_n + lfr_m]).reshape(1, -1))
-            else:
-                # process last LFR frame
-                num_padding = lfr_m - (T - i * lfr_n)
-                frame = inputs[i * lfr_n :].reshape(-1)
-                for _ in range(num_padding):
-                    frame = np.hstack((frame, inputs[-1]))
-
-                LFR_inputs.append(frame)
-        LFR_outputs = np.vstack(LFR_inputs).astype(np.float32)
-        return LFR_outputs
+        return stack_lfr_frames(inputs, lfr_m, lfr_n, T_lfr, left_padding=(lfr_m - 1) // 2)
 
     def apply_cmvn(self, inputs: np.ndarray) -> np.ndarray:
         """
-        Apply CMVN with mvn data
+        Apply CMVN with mvn data, broadcast in float32
         """
         frame, dim = inputs.shape
-        means = np.tile(self.cmvn[0:1, :dim], (frame, 1))
-        vars = np.tile(self.cmvn[1:2, :dim], (frame, 1))
-        inputs = (inputs + means) * vars
-        return inputs
+        # the shift allocates the output (inputs may be a read-only LFR view),
+        # the rescale then runs in place on it
+        outputs = np.add(inputs, self.cmvn[0, :dim], dtype=np.float32)
+        np.multiply(outputs, self.cmvn[1, :dim], out=outputs)
+        return outputs
 
     def load_cmvn(
         self,
     ) -> np.ndarray:
-        with open(self.cmvn_file, "r", encoding="utf-8") as f:
+        """Load (2, dim) float32 means/vars, cached as ``<cmvn_file>.npy`` after the first parse."""
+        cache_file = self.cmvn_file + ".npy"
+        try:
+            if os.path.getmtime(cache_file) >= os.path.getmtime(self.cmvn_file):
+                return np.load(cache_file)
+        except (OSError, ValueError):
+            pass
+
+        cmvn = self.parse_cmvn(self.cmvn_file)
+        try:
+            np.save(cache_file, cmvn)
+        except OSError:
+            pass  # read-only model dir: parse again next time
+        return cmvn
+
+    @staticmethod
+    def parse_cmvn(cmvn_file: str) -> np.ndarray:
+        with open(cmvn_file, "r", encoding="utf-8") as f:
             lines = f.readlines()
 
         means_list = []
@@ -145,8 +278,8 @@ class WavFrontend:
                     vars_list = list(rescale_line)
                     continue
 
-        means = np.array(means_list).astype(np.float64)
-        vars = np.array(vars_list).astype(np.float64)
+        means = np.array(means_list).astype(np.float32)
+        vars = np.array(vars_list).astype(np.float32)
         cmvn = np.array([means, vars])
         return cmvn
 
@@ -154,14 +287,9 @@ class WavFrontend:
 class WavFrontendOnline(WavFrontend):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
-        # self.fbank_fn = knf.OnlineFbank(self.opts)
         # add variables
-        self.frame_sample_length = int(
-            self.opts.frame_opts.frame_length_ms * self.opts.frame_opts.samp_freq / 1000
-        )
-        self.frame_shift_sample_length = int(
-            self.opts.frame_opts.frame_shift_ms * self.opts.frame_opts.samp_freq / 1000
-        )
+        self.frame_sample_length = self.fbank_fn.frame_length
+        self.frame_shift_sample_length = self.fbank_fn.frame_shift
         self.waveform = None
         self.reserve_waveforms = None
         self.input_cache = None
@@ -176,30 +304,20 @@ class WavFrontendOnline(WavFrontend):
         Apply lfr with data
         """
 
-        LFR_inputs = []
         T = inputs.shape[0]  # include the right context
         T_lfr = int(
             np.ceil((T - (lfr_m - 1) // 2) / lfr_n)
         )  # minus the right context: (lfr_m - 1) // 2
-        splice_idx = T_lfr
-        for i in range(T_lfr):
-            if lfr_m <= T - i * lfr_n:
-                LFR_inputs.append((inputs[i * lfr_n : i * lfr_n + lfr_m]).reshape(1, -1))
-            else:  # process last LFR frame
-                if is_final:
-                    num_padding = lfr_m - (T - i * lfr_n)
-                    frame = (inputs[i * lfr_n :]).reshape(-1)
-                    for _ in range(num_padding):
-                        frame = np.hstack((frame, inputs[-1]))
-                    LFR_inputs.append(frame)
-                else:
-                    # update splice_idx and break the circle
-                    splice_idx = i
-                    break
+        if is_final:
+            splice_idx = T_lfr
+        else:
+            # only frames with all lfr_m inputs available, the rest waits in the cache
+            num_full = (T - lfr_m) // lfr_n + 1 if T >= lfr_m else 0
+            splice_idx = min(T_lfr, num_full)
+        LFR_outputs = stack_lfr_frames(inputs, lfr_m, lfr_n, splice_idx)
         splice_idx = min(T - 1, splice_idx * lfr_n)
         lfr_splice_cache = inputs[splice_idx:, :]
-        LFR_outputs = np.vstack(LFR_inputs)
-        return LFR_outputs.astype(np.float32), lfr_splice_cache, splice_idx
+        return LFR_outputs, lfr_splice_cache, splice_idx
 
     @staticmethod
     def compute_frame_num(
@@ -211,7 +329,6 @@ class WavFrontendOnline(WavFrontend):
     def fbank(
         self, input: np.ndarray, input_lengths: np.ndarray
     ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
-        self.fbank_fn = knf.OnlineFbank(self.opts)
         batch_size = input.shape[0]
         if self.input_cache is None:
             self.input_cache = np.empty((batch_size, 0), dtype=np.float32)
@@ -240,15 +357,8 @@ class WavFrontendOnline(WavFrontend):
                         )
                     ]
                 )
-                waveform = waveform * (1 << 15)
-
-                self.fbank_fn.accept_waveform(self.opts.frame_opts.samp_freq, waveform.tolist())
-                frames = self.fbank_fn.num_frames_ready
-                mat = np.empty([frames, self.opts.mel_opts.num_bins])
-                for i in range(frames):
-                    mat[i, :] = self.fbank_fn.get_frame(i)
-                feat = mat.astype(np.float32)
-                feat_len = np.array(mat.shape[0]).astype(np.int32)
+                feat = self.fbank_fn(waveform.astype(np.float32) * (1 << 15))
+                feat_len = np.array(feat.shape[0]).astype(np.int32)
                 feats.append(feat)
                 feats_lens.append(feat_len)
 
@@ -363,7 +473,7 @@ class WavFrontendOnline(WavFrontend):
         return self.waveforms
 
     def cache_reset(self):
-        self.fbank_fn = knf.OnlineFbank(self.opts)
+        self.reset_status()
         self.reserve_waveforms = None
         self.input_cache = None
         self.lfr_splice_cache = []
@@ -398,12 +508,22 @@ class SinusoidalPositionEncoderOnline:
         encoding = np.concatenate((np.sin(scaled_time), np.cos(scaled_time)), axis=2)
         return encoding.astype(dtype)
 
+    def table(self, length: int, depth: int, dtype: np.dtype) -> np.ndarray:
+        """Encodings of positions 1..>=length, cached per (depth, dtype) and grown on demand."""
+        cache = self.__dict__.setdefault("_table_cache", {})
+        key = (depth, np.dtype(dtype))
+        table = cache.get(key)
+        if table is None or table.shape[1] < length:
+            size = max(length, 2 * table.shape[1] if table is not None else 512)
+            positions = np.arange(1, size + 1)[None, :]
+            table = self.encode(positions, depth, dtype)
+            cache[key] = table
+        return table
+
     def forward(self, x, start_idx=0):
         batch_size, timesteps, input_dim = x.shape
-        positions = np.arange(1, timesteps + 1 + start_idx)[None, :]
-        position_encoding = self.encode(positions, input_dim, x.dtype)
-
-        return x + position_encoding[:, start_idx : start_idx + timesteps]
+        table = self.table(start_idx + timesteps, input_dim, x.dtype)
+        return x + table[:, start_idx : start_idx + timesteps]
 
 
 def test():
@@ -6,7 +6,6 @@
 import os.path
 from pathlib import Path
 from typing import List, Union, Tuple
-import torch
 import librosa
 import numpy as np
 
@@ -71,33 +70,53 @@ class SenseVoiceSmallONNX:
                  textnorm: List,
                  tokenizer=None,
                  **kwargs) -> List:
-        waveform_list = self.load_data(wav_content, self.frontend.opts.frame_opts.samp_freq)
+        """Batched recognition.
+
+        Inputs are sorted by length so that every batch holds utterances of similar
+        duration (little padding), each row of a batch is decoded, and the results
+        come back in the input order. ``language`` / ``textnorm`` are either one id
+        for all inputs or one id per input.
+        """
+        waveform_list = self.load_data(wav_content, self.frontend.fbank_fn.fs)
         waveform_nums = len(waveform_list)
-        asr_res = []
+        language = self.expand_ids(language, waveform_nums)
+        textnorm = self.expand_ids(textnorm, waveform_nums)
+
+        # the frame count only depends on the number of samples, so the buckets are
+        # known before any feature is extracted
+        sorted_idx = np.argsort([len(waveform) for waveform in waveform_list], kind="stable")
+        asr_res = [None] * waveform_nums
         for beg_idx in range(0, waveform_nums, self.batch_size):
-            end_idx = min(waveform_nums, beg_idx + self.batch_size)
-            feats, feats_len = self.extract_feat(waveform_list[beg_idx:end_idx])
-            ctc_logits, encoder_out_lens = self.infer(feats, 
-                                 feats_len, 
-                                 np.array(language, dtype=np.int32), 
-                                 np.array(textnorm, dtype=np.int32)
-                                 )
-            # back to torch.Tensor
-            ctc_logits = torch.from_numpy(ctc_logits).float()
-            # support batch_size=1 only currently
-            x = ctc_logits[0, : encoder_out_lens[0].item(), :]
-            yseq = x.argmax(dim=-1)
-            yseq = torch.unique_consecutive(yseq, dim=-1)
-
-            mask = yseq != self.blank_id
-            token_int = yseq[mask].tolist()
-            
-            if tokenizer is not None:
-                asr_res.append(tokenizer.tokens2text(token_int))
-            else:
-                asr_res.append(token_int)
+            batch_idx = sorted_idx[beg_idx : beg_idx + self.batch_size]
+            feats, feats_len = self.extract_feat([waveform_list[i] for i in batch_idx])
+            ctc_logits, encoder_out_lens = self.infer(
+                feats, feats_len, language[batch_idx], textnorm[batch_idx]
+            )
+            token_ints = self.ctc_greedy_search(ctc_logits, encoder_out_lens)
+            for i, token_int in zip(batch_idx, token_ints):
+                if tokenizer is not None:
+                    asr_res[i] = tokenizer.tokens2text(token_int)
+                else:
+                    asr_res[i] = token_int
         return asr_res
 
+    @staticmethod
+    def expand_ids(ids, num: int) -> np.ndarray:
+        ids = np.atleast_1d(np.asarray(ids, dtype=np.int32))
+        if len(ids) == 1:
+            return np.repeat(ids, num)
+        if len(ids) != num:
+            raise ValueError(f"expected 1 or {num} ids, got {len(ids)}")
+        return ids
+
+    def ctc_greedy_search(self, ctc_logits: np.ndarray, encoder_out_lens: np.ndarray) -> List:
+        """Greedy CTC for a whole padded batch: argmax, collapse repeats, drop blanks."""
+        yseq = ctc_logits.argmax(axis=-1)
+        valid = np.arange(yseq.shape[1])[None, :] < np.asarray(encoder_out_lens).reshape(-1, 1)
+        keep = valid & (yseq != self.blank_id)
+        keep[:, 1:] &= yseq[:, 1:] != yseq[:, :-1]
+        return [row[mask].tolist() for row, mask in zip(yseq, keep)]
+
     def load_data(self, wav_content: Union[str, np.ndarray, List[str]], fs: int = None) -> List:
         def load_wav(path: str) -> np.ndarray:
             waveform, _ = librosa.load(path, sr=fs)
@@ -110,7 +129,9 @@ class SenseVoiceSmallONNX:
             return [load_wav(wav_content)]
 
         if isinstance(wav_content, list):
-            return [load_wav(path) for path in wav_content]
+            return [
+                item if isinstance(item, np.ndarray) else load_wav(item) for item in wav_content
+            ]
 
         raise TypeError(f"The type of {wav_content} is not in [str, np.ndarray, list]")
 
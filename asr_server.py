@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+"""
+常驻 ASR 服务：SenseVoiceSmall 只加载一次，通过本机 HTTP 为多个进程提供识别。
+
+    python asr_server.py --port 10095
+
+接口：
+    POST /asr?sample_rate=48000&language=auto&use_itn=0
+        请求体为 int16 单声道 PCM，返回 JSON:
+        {"text", "raw_text", "language", "emotion", "event"}
+    GET  /health
+
+并发请求进入同一个队列，由批处理线程在 max_wait_ms 内尽量凑满 max_batch 条，
+一次 generate 完成整批推理。VoiceAssistant 设置 Config.ASR_SERVER_URL 即可改用本服务。
+"""
+import argparse
+import json
+import os
+import queue
+import re
+import threading
+import time
+import traceback
+import urllib.parse
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+TAG_PATTERN = re.compile(r"<\|(.*?)\|>")
+
+
+def parse_sensevoice_text(raw_text):
+    """拆分 SenseVoice 输出开头的 <|语种|><|情绪|><|事件|><|itn|> 标签"""
+    tags = TAG_PATTERN.findall(raw_text)
+    tags += [""] * (3 - len(tags))
+    return {
+        "text": TAG_PATTERN.sub("", raw_text).strip(),
+        "raw_text": raw_text,
+        "language": tags[0],
+        "emotion": tags[1],
+        "event": tags[2],
+    }
+
+
+class _Request:
+    def __init__(self, audio, sample_rate, language, use_itn):
+        self.audio = audio
+        self.sample_rate = sample_rate
+        self.language = language
+        self.use_itn = use_itn
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class ASRServer:
+    """
+    动态批处理的识别服务
+
+    Args:
+        model_dir: SenseVoiceSmall 模型目录
+        device: 推理设备
+        max_batch: 每批最多合并的请求数
+        max_wait_ms: 收到第一条请求后最多再等多久凑批
+        quantize: 使用 INT8 动态量化模型
+        attention: 编码器注意力实现，"sanm" 或融合实现 "sanm_sdpa"
+        packed: 长短不一的请求合批时打包编码，padding 帧不参与计算（结果不变）
+        compile_cache: 给出目录时把编码器编译为 TorchScript，计算图缓存在该目录
+    """
+
+    def __init__(
+        self,
+        model_dir="./SenseVoiceSmall",
+        device="cpu",
+        max_batch=8,
+        max_wait_ms=20,
+        quantize=False,
+        attention="sanm",
+        packed=True,
+        compile_cache=None,
+    ):
+        from funasr import AutoModel
+
+        self.model = AutoModel(
+            model=model_dir,
+            trust_remote_code=True,
+            remote_code=os.path.join(model_dir, "model.py"),
+            device=device,
+            disable_update=True,
+            disable_pbar=True,
+            encoder_conf={"selfattention_layer_type": attention},
+        )
+        if quantize:
+            self.model.model.quantize()
+        if compile_cache:
+            self.model.model.compile_encoder(compile_cache)
+        # 预热：第一条请求不再承担首次推理的开销
+        self.model.generate(input=np.zeros(16000, dtype=np.float32), cache={}, language="auto")
+        self.max_batch = max_batch
+        self.packed = packed
+        self.max_wait = max_wait_ms / 1000.0
+        self.requests = queue.Queue()
+        threading.Thread(target=self._batch_worker, daemon=True).start()
+
+    def recognize(self, audio, sample_rate=16000, language="auto", use_itn=False):
+        """提交一条 float32 音频并等待结果（可在任意线程调用）"""
+        request = _Request(audio, sample_rate, language, use_itn)
+        self.requests.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def _next_batch(self):
+        batch = [self.requests.get()]
+        deadline = time.time() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.requests.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _batch_worker(self):
+        while True:
+            batch = self._next_batch()
+            # 采样率、语种、itn 相同的请求才能放进同一次 generate
+            groups = {}
+            for request in batch:
+                groups.setdefault(
+                    (request.sample_rate, request.language, request.use_itn), []
+                ).append(request)
+
+            for (sample_rate, language, use_itn), requests in groups.items():
+                try:
+                    res = self.model.generate(
+                        input=[request.audio for request in requests],
+                        batch_size=len(requests),
+                        cache={},
+                        language=language,
+                        use_itn=use_itn,
+                        fs=sample_rate,
+                        packed_encoder=self.packed,
+                    )
+                    for request, item in zip(requests, res):
+                        request.result = parse_sensevoice_text(item.get("text", ""))
+                except Exception as e:
+                    traceback.print_exc()
+                    for request in requests:
+                        request.error = e
+                for request in requests:
+                    request.done.set()
+
+    def serve(self, host="127.0.0.1", port=10095):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/health":
+                    self._reply(200, {"status": "ok"})
+                else:
+                    self._reply(404, {"error": "not found"})
+
+            def do_POST(self):
+                url = urllib.parse.urlparse(self.path)
+                if url.path != "/asr":
+                    self._reply(404, {"error": "not found"})
+                    return
+                query = urllib.parse.parse_qs(url.query)
+                try:
+                    sample_rate = int(query.get("sample_rate", ["16000"])[0])
+                    language = query.get("language", ["auto"])[0]
+                    use_itn = query.get("use_itn", ["0"])[0] in ("1", "true")
+                    length = int(self.headers.get("Content-Length", 0))
+                    pcm = self.rfile.read(length)
+                    audio = np.frombuffer(pcm, dtype=np.int16).astype(np.float32) / 32768.0
+                    if len(audio) == 0:
+                        self._reply(400, {"error": "empty audio"})
+                        return
+                    self._reply(200, server.recognize(audio, sample_rate, language, use_itn))
+                except Exception as e:
+                    self._reply(500, {"error": str(e)})
+
+            def _reply(self, code, body):
+                data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        httpd = ThreadingHTTPServer((host, port), Handler)
+        httpd.daemon_threads = True
+        print(f">>> [ASR 服务] 监听 http://{host}:{port}")
+        httpd.serve_forever()
+
+
+class ASRClient:
+    """ASR 服务的客户端，recognize() 与 ASRServer.recognize() 返回相同的字典"""
+
+    def __init__(self, url="http://127.0.0.1:10095", timeout=30):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+
+    def recognize(self, audio, sample_rate=16000, language="auto", use_itn=False):
+        """audio 为 float32 [-1, 1] 或 int16 数组"""
+        audio = np.asarray(audio)
+        if audio.dtype != np.int16:
+            audio = (np.clip(audio, -1.0, 1.0) * 32767).astype(np.int16)
+        query = urllib.parse.urlencode(
+            {"sample_rate": sample_rate, "language": language, "use_itn": int(use_itn)}
+        )
+        request = urllib.request.Request(
+            f"{self.url}/asr?{query}",
+            data=audio.tobytes(),
+            headers={"Content-Type": "application/octet-stream"},
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return json.loads(response.read().decode("utf-8"))
+
+    def health(self):
+        try:
+            with urllib.request.urlopen(f"{self.url}/health", timeout=self.timeout) as response:
+                return response.status == 200
+        except OSError:
+            return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SenseVoiceSmall 常驻识别服务")
+    parser.add_argument("--model-dir", default="./SenseVoiceSmall")
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=10095)
+    parser.add_argument("--max-batch", type=int, default=8)
+    parser.add_argument("--max-wait-ms", type=int, default=20)
+    parser.add_argument("--quantize", action="store_true", help="INT8 动态量化")
+    parser.add_argument(
+        "--attention", default="sanm", choices=["sanm", "sanm_sdpa"], help="编码器注意力实现"
+    )
+    parser.add_argument("--no-packed", action="store_true", help="合批时按 padding 对齐编码")
+    parser.add_argument("--compile-cache", help="编译编码器为 TorchScript 并缓存到该目录")
+    args = parser.parse_args()
+
+    server = ASRServer(
+        args.model_dir, args.device, args.max_batch, args.max_wait_ms,
+        quantize=args.quantize, attention=args.attention, packed=not args.no_packed,
+        compile_cache=args.compile_cache,
+    )
+    server.serve(args.host, args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+基于环形缓冲区的 PCM 播放器。
+
+TTS 合成出的 float32 / int16 PCM 直接写入环形缓冲区，由 sounddevice 的回调式输出流
+连续取数播放：相邻句子首尾相接、没有间隙，也不需要 mp3 解码和 get_busy() 轮询。
+每次写入都会返回一个 threading.Event，在该段音频的最后一个采样被送入声卡时置位。
+"""
+import threading
+from collections import deque
+
+import numpy as np
+import sounddevice as sd
+
+
+def to_float32(pcm):
+    """int16 / float PCM -> float32 单声道 [-1, 1]"""
+    pcm = np.asarray(pcm)
+    if pcm.dtype == np.int16:
+        pcm = pcm.astype(np.float32) / 32768.0
+    elif pcm.dtype != np.float32:
+        pcm = pcm.astype(np.float32)
+    if pcm.ndim > 1:
+        pcm = pcm.mean(axis=1, dtype=np.float32)
+    return pcm
+
+
+def resample_linear(pcm, src_rate, dst_rate):
+    """线性插值重采样（语音播放足够用，无额外依赖）"""
+    if src_rate == dst_rate or len(pcm) == 0:
+        return pcm
+    n_out = int(round(len(pcm) * dst_rate / src_rate))
+    x_out = np.arange(n_out, dtype=np.float64) * (src_rate / dst_rate)
+    return np.interp(x_out, np.arange(len(pcm)), pcm).astype(np.float32)
+
+
+class PCMPlayer:
+    """
+    回调驱动的 PCM 播放器
+
+    Args:
+        sample_rate: 输出流采样率，写入的音频若采样率不同会先重采样
+        buffer_seconds: 环形缓冲区容量（秒），写满时 write() 阻塞，形成背压
+        blocksize: 声卡回调每次取的帧数
+        device: sounddevice 输出设备，None 为系统默认
+    """
+
+    def __init__(self, sample_rate=48000, buffer_seconds=20.0, blocksize=1024, device=None):
+        self.sample_rate = sample_rate
+        self.capacity = int(sample_rate * buffer_seconds)
+        self.ring = np.zeros(self.capacity, dtype=np.float32)
+
+        # 读写位置都是累计帧数，对 capacity 取模得到环内下标
+        self.read_pos = 0
+        self.write_pos = 0
+        self.marks = deque()  # (结束位置, 回调)，按写入顺序排列
+        self.generation = 0   # 每次 clear() 加一，用于中止被清空前发起的写入
+        self.cond = threading.Condition()
+
+        self.stream = sd.OutputStream(
+            samplerate=sample_rate,
+            channels=1,
+            dtype="float32",
+            blocksize=blocksize,
+            device=device,
+            callback=self._callback,
+        )
+        self.stream.start()
+
+    @property
+    def is_playing(self):
+        return self.write_pos > self.read_pos
+
+    def write(self, pcm, sample_rate=None, on_done=None, generation=None):
+        """
+        追加一段 PCM，返回该段播放完毕时置位的 Event
+
+        Args:
+            pcm: float32 或 int16 单声道数组
+            sample_rate: pcm 的采样率，默认与输出流一致
+            on_done: 可选回调，在声卡回调线程中调用，应尽量轻量
+            generation: 调用方在确认这段音频仍然有效时读取的 self.generation；
+                之后发生过 clear() 则整段丢弃。None 表示以进入 write() 时为准
+        """
+        pcm = to_float32(pcm)
+        if sample_rate is not None:
+            pcm = resample_linear(pcm, sample_rate, self.sample_rate)
+
+        if generation is None:
+            generation = self.generation
+        offset = 0
+        while offset < len(pcm):
+            with self.cond:
+                while (
+                    self.write_pos - self.read_pos >= self.capacity
+                    and generation == self.generation
+                ):
+                    self.cond.wait()
+                if generation != self.generation:
+                    break  # 写入前或写入途中被 clear()，剩余部分丢弃
+                free = self.capacity - (self.write_pos - self.read_pos)
+                n = min(free, len(pcm) - offset)
+                self._copy_in(pcm[offset : offset + n])
+                self.write_pos += n
+                offset += n
+
+        return self.mark(on_done)
+
+    def mark(self, on_done=None):
+        """返回一个 Event：当前已写入的音频全部播放完毕时置位（缓冲区为空时立即置位）"""
+        done = threading.Event()
+
+        def _fire():
+            done.set()
+            if on_done is not None:
+                on_done()
+
+        with self.cond:
+            if self.write_pos == self.read_pos:
+                _fire()
+            else:
+                self.marks.append((self.write_pos, _fire))
+        return done
+
+    def clear(self):
+        """丢弃尚未播放的音频（用于打断），所有未完成的 Event 立即置位"""
+        with self.cond:
+            self.generation += 1
+            self.read_pos = self.write_pos
+            self._fire_marks()
+            self.cond.notify_all()
+
+    def wait_done(self, timeout=None):
+        """阻塞直到缓冲区中的音频全部播放完毕"""
+        return self.mark().wait(timeout)
+
+    def close(self):
+        self.clear()
+        self.stream.stop()
+        self.stream.close()
+
+    def _copy_in(self, pcm):
+        start = self.write_pos % self.capacity
+        first = min(len(pcm), self.capacity - start)
+        self.ring[start : start + first] = pcm[:first]
+        self.ring[: len(pcm) - first] = pcm[first:]
+
+    def _fire_marks(self):
+        while self.marks and self.marks[0][0] <= self.read_pos:
+            self.marks.popleft()[1]()
+
+    def _callback(self, outdata, frames, time_info, status):
+        out = outdata[:, 0]
+        with self.cond:
+            n = min(frames, self.write_pos - self.read_pos)
+            start = self.read_pos % self.capacity
+            first = min(n, self.capacity - start)
+            out[:first] = self.ring[start : start + first]
+            out[first:n] = self.ring[: n - first]
+            out[n:] = 0.0
+            self.read_pos += n
+            if n:
+                self._fire_marks()
+                self.cond.notify_all()
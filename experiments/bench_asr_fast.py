@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+SenseVoiceSmall 快速模式的延迟 / CER 取舍曲线
+依次测试只跑前 N 个 tp 块、以及按 CTC 置信度提前退出的各档配置，
+统计 example/*.mp3 与命令行追加的录音上的总耗时和平均字错率 (CER)。
+没有参考文本时以完整模型 (20 个 tp 块) 的输出为参考；
+--ref 可指定 "文件名<TAB>参考文本" 格式的标注文件。
+用法: python experiments/bench_asr_fast.py [my1.wav my2.wav ...] [--ref refs.tsv] [--repeat 3]
+"""
+import argparse
+import glob
+import os
+import re
+import statistics
+import time
+
+import librosa
+import torch
+from funasr import AutoModel
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODEL_DIR = os.path.join(ROOT, "SenseVoiceSmall")
+
+
+def edit_distance(ref, hyp):
+    row = list(range(len(hyp) + 1))
+    for i, r in enumerate(ref, 1):
+        prev, row[0] = row[0], i
+        for j, h in enumerate(hyp, 1):
+            prev, row[j] = row[j], min(row[j] + 1, row[j - 1] + 1, prev + (r != h))
+    return row[-1]
+
+
+def normalize(text):
+    text = re.sub(r"<\|.*?\|>", "", text)
+    return re.sub(r"[\s,.!?，。！？、]", "", text).lower()
+
+
+def cer(ref, hyp):
+    ref, hyp = normalize(ref), normalize(hyp)
+    return edit_distance(ref, hyp) / max(len(ref), 1)
+
+
+def recognize(model, audio, repeat, fast_mode):
+    model.generate(input=audio, cache={}, language="auto", use_itn=False, **fast_mode)  # 预热
+    costs = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        res = model.generate(input=audio, cache={}, language="auto", use_itn=False, **fast_mode)
+        costs.append(time.perf_counter() - t)
+    return res[0]["text"], statistics.median(costs) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("clips", nargs="*", help="额外的音频文件")
+    parser.add_argument("--ref", help="参考文本，每行 文件名<TAB>文本")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--exit-blocks", default="10", help="检查置信度的 tp 块位置，逗号分隔")
+    args = parser.parse_args()
+    torch.set_num_threads(args.threads)
+
+    model = AutoModel(
+        model=MODEL_DIR,
+        trust_remote_code=True,
+        remote_code=os.path.join(MODEL_DIR, "model.py"),
+        device="cpu",
+        disable_update=True,
+        disable_pbar=True,
+    )
+    paths = sorted(glob.glob(os.path.join(ROOT, "example", "*.mp3"))) + args.clips
+    clips = [(os.path.basename(path), librosa.load(path, sr=16000)[0]) for path in paths]
+
+    refs = {}
+    if args.ref:
+        with open(args.ref, encoding="utf-8") as f:
+            for line in f:
+                if "\t" in line:
+                    name, text = line.rstrip("\n").split("\t", 1)
+                    refs[os.path.basename(name)] = text
+    for name, audio in clips:
+        if name not in refs:
+            refs[name] = recognize(model, audio, 1, {})[0]
+
+    exit_blocks = tuple(int(n) for n in args.exit_blocks.split(","))
+    configs = [("全部 20 块", {})]
+    configs += [(f"tp_blocks={n}", {"tp_blocks": n}) for n in (16, 12, 8, 4, 0)]
+    configs += [
+        (f"exit>={threshold}", {"exit_threshold": threshold, "exit_blocks": exit_blocks})
+        for threshold in (0.95, 0.9, 0.8, 0.6)
+    ]
+
+    total_audio = sum(len(audio) for _, audio in clips) / 16000
+    print(f"{len(clips)} 条音频，共 {total_audio:.1f}s；参考文本: {'标注' if args.ref else '完整模型输出'}")
+    print(f"\n{'配置':<16}{'总耗时(ms)':>12}{'RTF':>8}{'平均CER':>10}")
+    for label, fast_mode in configs:
+        total, errors = 0.0, []
+        for name, audio in clips:
+            text, cost = recognize(model, audio, args.repeat, fast_mode)
+            total += cost
+            errors.append(cer(refs[name], text))
+        print(
+            f"{label:<16}{total:>12.1f}{total / 1000 / total_audio:>8.3f}"
+            f"{statistics.mean(errors):>10.1%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+SenseVoiceSmall FP32 vs INT8 动态量化对比
+在 example/*.mp3 上分别统计识别耗时、与 FP32 结果的一致率，以及模型权重体积，并打印两者的识别文本。
+--ref 可指定 "文件名<TAB>参考文本" 标注，此时另外给出 FP32 与 INT8 各自的 CER。
+--model-dir 可指定其他模型目录（默认为仓库中的 SenseVoiceSmall）。
+用法: python experiments/bench_asr_quant.py [--repeat 5] [--threads 4] [--ref refs.tsv] [--model-dir DIR]
+"""
+import argparse
+import difflib
+import glob
+import io
+import os
+import re
+import statistics
+import time
+
+import librosa
+import torch
+from funasr import AutoModel
+
+from bench_asr_fast import cer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODEL_DIR = os.path.join(ROOT, "SenseVoiceSmall")
+
+
+def load_model(model_dir, quantize):
+    model = AutoModel(
+        model=model_dir,
+        trust_remote_code=True,
+        remote_code=os.path.join(model_dir, "model.py"),
+        device="cpu",
+        disable_update=True,
+        disable_pbar=True,
+    )
+    if quantize:
+        model.model.quantize()
+    return model
+
+
+def state_dict_mb(model):
+    buf = io.BytesIO()
+    torch.save(model.model.state_dict(), buf)
+    return buf.tell() / 1024 / 1024
+
+
+def recognize(model, audio, repeat):
+    model.generate(input=audio, cache={}, language="auto", use_itn=False)  # 预热
+    costs = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        res = model.generate(input=audio, cache={}, language="auto", use_itn=False)
+        costs.append(time.perf_counter() - t)
+    text = re.sub(r"<\|.*?\|>", "", res[0]["text"]).strip()
+    return text, statistics.median(costs) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--model-dir", default=MODEL_DIR)
+    parser.add_argument("--ref", help="参考文本，每行 文件名<TAB>文本")
+    args = parser.parse_args()
+    torch.set_num_threads(args.threads)
+
+    refs = {}
+    if args.ref:
+        with open(args.ref, encoding="utf-8") as f:
+            for line in f:
+                if "\t" in line:
+                    name, text = line.rstrip("\n").split("\t", 1)
+                    refs[os.path.basename(name)] = text
+
+    models = {"fp32": load_model(args.model_dir, False), "int8": load_model(args.model_dir, True)}
+    for name, model in models.items():
+        print(f"{name} 权重体积: {state_dict_mb(model):.1f} MB")
+
+    header = f"\n{'文件':<12}{'时长(s)':>8}{'FP32(ms)':>10}{'INT8(ms)':>10}{'加速':>8}{'一致率':>8}"
+    print(header + (f"{'FP32 CER':>10}{'INT8 CER':>10}" if refs else ""))
+    errors = {"fp32": [], "int8": []}
+    for path in sorted(glob.glob(os.path.join(ROOT, "example", "*.mp3"))):
+        audio, _ = librosa.load(path, sr=16000)
+        text_fp32, t_fp32 = recognize(models["fp32"], audio, args.repeat)
+        text_int8, t_int8 = recognize(models["int8"], audio, args.repeat)
+        # 以 FP32 输出为参考计算字符级一致率；有标注时另算各自的 CER
+        agreement = difflib.SequenceMatcher(None, text_fp32, text_int8).ratio()
+        name = os.path.basename(path)
+        row = (
+            f"{name:<12}{len(audio) / 16000:>8.1f}{t_fp32:>10.1f}"
+            f"{t_int8:>10.1f}{t_fp32 / t_int8:>7.2f}x{agreement:>8.1%}"
+        )
+        if name in refs:
+            errors["fp32"].append(cer(refs[name], text_fp32))
+            errors["int8"].append(cer(refs[name], text_int8))
+            row += f"{errors['fp32'][-1]:>10.1%}{errors['int8'][-1]:>10.1%}"
+        print(row)
+        print(f"    fp32: {text_fp32}\n    int8: {text_int8}")
+
+    if errors["fp32"]:
+        print(
+            f"\n平均 CER ({len(errors['fp32'])} 条): FP32 {statistics.mean(errors['fp32']):.1%}，"
+            f"INT8 {statistics.mean(errors['int8']):.1%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
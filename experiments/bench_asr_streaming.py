@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+SenseVoiceSmall 流式识别 vs 整句离线识别：字错率与说话结束后的延迟
+把 example/*.mp3 与命令行追加的录音重采样到麦克风采样率，按 voice_assistant 的
+CHUNK 大小逐块送入 inference_chunk，统计流式最终结果相对离线结果的 CER，
+以及说话结束后还需要的时间（流式：最后一次 is_final 调用；离线：整句识别）。
+--ref 可指定 "文件名<TAB>参考文本" 标注，此时两者都与标注比较。
+用法: python experiments/bench_asr_streaming.py [my1.wav ...] [--ref refs.tsv] [--chunk-sizes 0,10,5 0,5,5]
+"""
+import argparse
+import glob
+import os
+import statistics
+import time
+
+import librosa
+import numpy as np
+import torch
+from funasr import AutoModel
+
+from bench_asr_fast import cer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODEL_DIR = os.path.join(ROOT, "SenseVoiceSmall")
+
+
+def offline(model, audio, fs):
+    t = time.perf_counter()
+    res = model.generate(input=audio, cache={}, language="auto", use_itn=False, fs=fs)
+    return res[0]["text"], time.perf_counter() - t
+
+
+def streaming(model, audio, fs, chunk, chunk_size):
+    kwargs = dict(model.kwargs)
+    for name in ("cache", "is_final", "chunk_size", "look_back"):
+        kwargs.pop(name, None)
+    kwargs.update(fs=fs, language="auto", use_itn=False)
+    cache = {}
+    with torch.no_grad():
+        for i in range(0, len(audio), chunk):
+            model.model.inference_chunk(audio[i : i + chunk], cache, chunk_size=chunk_size, **kwargs)
+        t = time.perf_counter()
+        res, _ = model.model.inference_chunk(
+            np.zeros(0, dtype=np.float32), cache, is_final=True, chunk_size=chunk_size, **kwargs
+        )
+    return res[0]["text"], time.perf_counter() - t
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("clips", nargs="*", help="额外的音频文件")
+    parser.add_argument("--ref", help="参考文本，每行 文件名<TAB>文本")
+    parser.add_argument("--fs", type=int, default=48000, help="麦克风采样率")
+    parser.add_argument("--chunk", type=int, default=4096, help="每次送入的采样数")
+    parser.add_argument("--chunk-sizes", nargs="+", default=["0,10,5", "0,5,5", "0,10,0"])
+    parser.add_argument("--threads", type=int, default=4)
+    args = parser.parse_args()
+    torch.set_num_threads(args.threads)
+
+    model = AutoModel(
+        model=MODEL_DIR,
+        trust_remote_code=True,
+        remote_code=os.path.join(MODEL_DIR, "model.py"),
+        device="cpu",
+        disable_update=True,
+        disable_pbar=True,
+    )
+    paths = sorted(glob.glob(os.path.join(ROOT, "example", "*.mp3"))) + args.clips
+    clips = [(os.path.basename(path), librosa.load(path, sr=args.fs)[0]) for path in paths]
+
+    refs = {}
+    if args.ref:
+        with open(args.ref, encoding="utf-8") as f:
+            for line in f:
+                if "\t" in line:
+                    name, text = line.rstrip("\n").split("\t", 1)
+                    refs[os.path.basename(name)] = text
+
+    offline(model, clips[0][1], args.fs)  # 预热
+    offline_cost, offline_errors = [], []
+    for name, audio in clips:
+        text, cost = offline(model, audio, args.fs)
+        offline_cost.append(cost)
+        if name in refs:
+            offline_errors.append(cer(refs[name], text))
+        refs.setdefault(name, text)
+
+    total_audio = sum(len(audio) for _, audio in clips) / args.fs
+    print(f"{len(clips)} 条音频，共 {total_audio:.1f}s；参考文本: {'标注' if args.ref else '离线识别结果'}")
+    print(f"\n{'配置':<16}{'结束后耗时(ms)':>16}{'平均CER':>10}")
+    offline_cer = statistics.mean(offline_errors) if offline_errors else 0.0
+    print(f"{'离线整句':<16}{statistics.mean(offline_cost) * 1000:>16.1f}{offline_cer:>10.1%}")
+    for spec in args.chunk_sizes:
+        chunk_size = [int(n) for n in spec.split(",")]
+        costs, errors = [], []
+        for name, audio in clips:
+            text, cost = streaming(model, audio, args.fs, args.chunk, chunk_size)
+            costs.append(cost)
+            errors.append(cer(refs[name], text))
+        print(f"{'流式 ' + spec:<16}{statistics.mean(costs) * 1000:>16.1f}{statistics.mean(errors):>10.1%}")
+
+
+if __name__ == "__main__":
+    main()
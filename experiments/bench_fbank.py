@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+fbank 特征提取微基准：逐帧 knf.OnlineFbank.get_frame() vs 批量 KaldiFbank
+在 example/*.mp3 上分别计时，并给出两者特征的最大差值（dither=0）。
+用法: python experiments/bench_fbank.py [--repeat 20] [--tile 1]
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+
+import numpy as np
+import librosa
+import kaldi_native_fbank as knf
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "SenseVoiceSmall"))
+from utils.frontend import KaldiFbank
+
+
+def knf_options():
+    """改动前 WavFrontend 的默认 FbankOptions（dither=0）"""
+    opts = knf.FbankOptions()
+    opts.frame_opts.samp_freq = 16000
+    opts.frame_opts.dither = 0.0
+    opts.frame_opts.window_type = "hamming"
+    opts.frame_opts.frame_shift_ms = 10.0
+    opts.frame_opts.frame_length_ms = 25.0
+    opts.mel_opts.num_bins = 80
+    opts.energy_floor = 0
+    opts.frame_opts.snip_edges = True
+    opts.mel_opts.debug_mel = False
+    return opts
+
+
+def fbank_per_frame(opts, waveform):
+    """改动前 WavFrontend.fbank 的实现"""
+    waveform = waveform * (1 << 15)
+    fbank_fn = knf.OnlineFbank(opts)
+    fbank_fn.accept_waveform(opts.frame_opts.samp_freq, waveform.tolist())
+    frames = fbank_fn.num_frames_ready
+    mat = np.empty([frames, opts.mel_opts.num_bins])
+    for i in range(frames):
+        mat[i, :] = fbank_fn.get_frame(i)
+    return mat.astype(np.float32)
+
+
+def timeit(fn, repeat):
+    fn()  # 预热
+    t = time.perf_counter()
+    for _ in range(repeat):
+        out = fn()
+    return (time.perf_counter() - t) / repeat * 1000, out
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--tile", type=int, default=1, help="把音频重复 N 次以模拟长句")
+    args = parser.parse_args()
+
+    opts = knf_options()
+    batched = KaldiFbank(dither=0.0)
+
+    print(f"{'文件':<12}{'时长(s)':>8}{'逐帧(ms)':>10}{'批量(ms)':>10}{'加速':>8}{'最大差值':>12}")
+    for path in sorted(glob.glob(os.path.join(ROOT, "example", "*.mp3"))):
+        waveform, _ = librosa.load(path, sr=16000)
+        waveform = np.tile(waveform, args.tile).astype(np.float32)
+
+        t_old, feat_old = timeit(lambda: fbank_per_frame(opts, waveform), args.repeat)
+        t_new, feat_new = timeit(lambda: batched(waveform * (1 << 15)), args.repeat)
+        diff = np.abs(feat_old - feat_new).max()
+        print(
+            f"{os.path.basename(path):<12}{len(waveform) / 16000:>8.1f}"
+            f"{t_old:>10.2f}{t_new:>10.2f}{t_old / t_new:>7.1f}x{diff:>12.2e}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+compile_encoder 磁盘缓存的权重检查
+用同一个缓存目录依次编译两个权重不同的模型（FP32 与 INT8 动态量化各一组）：
+第二个模型直接读取第一个模型保存的计算图，其输出必须与它自己的 eager 输出一致，
+即缓存中不含权重、加载后绑定的是本模型的参数与量化 Linear 的打包权重。
+同时打印缓存文件大小。随机初始化的小模型即可，不需要 model.pt。
+用法: python experiments/check_compile_cache.py [--tol 1e-4]
+"""
+import argparse
+import os
+import sys
+import tempfile
+
+import torch
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "SenseVoiceSmall"))
+from model import SenseVoiceSmall
+
+
+def build(seed, quantize):
+    torch.manual_seed(seed)
+    model = SenseVoiceSmall(
+        encoder="SenseVoiceEncoderSmall",
+        encoder_conf=dict(
+            output_size=64, attention_heads=4, linear_units=128, num_blocks=3, tp_blocks=4,
+            kernel_size=11, sanm_shfit=0, input_layer="pe", dropout_rate=0.0,
+            attention_dropout_rate=0.0, normalize_before=True,
+        ),
+        input_size=560,
+        vocab_size=50,
+    ).eval()
+    return model.quantize() if quantize else model
+
+
+def max_diff(model, speech, lengths):
+    with torch.no_grad():
+        encoder_out, _ = model.encoder(speech, lengths)
+        ref = model.ctc.log_softmax(encoder_out)
+        out, _ = model._compiled_encoder(speech, lengths)
+    diff = 0.0
+    for i, n in enumerate(lengths.tolist()):
+        diff = max(diff, (ref[i, :n] - out[i, :n]).abs().max().item())
+    return diff
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tol", type=float, default=1e-4)
+    args = parser.parse_args()
+
+    speech = torch.randn(2, 80, 560)
+    lengths = torch.tensor([80, 50])
+    failed = False
+    print(f"{'变体':<8}{'模型':<8}{'读取缓存':>10}{'最大差值':>12}{'缓存大小':>12}")
+    for quantize in (False, True):
+        variant = "int8" if quantize else "fp32"
+        with tempfile.TemporaryDirectory() as cache_dir:
+            for seed in (0, 1):
+                model = build(seed, quantize)
+                loaded = model.compile_encoder(cache_dir)
+                diff = max_diff(model, speech, lengths)
+                size = sum(os.path.getsize(os.path.join(cache_dir, f)) for f in os.listdir(cache_dir))
+                failed |= diff > args.tol
+                print(f"{variant:<8}{seed:<8}{str(loaded):>10}{diff:>12.2e}{size / 1024:>10.1f}KB")
+    if failed:
+        print("\n失败：读取缓存的模型输出与其 eager 输出不一致")
+        sys.exit(1)
+    print("\n通过")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+MultiHeadedAttentionSANM vs MultiHeadedAttentionSANMFused 数值一致性与耗时对比
+两者共享同一份随机权重，输入为带 padding 的批次（各条长度不同），
+比较有效帧上的最大差值，并统计单层前向耗时；若 SenseVoiceSmall/model.pt 存在，
+再用真实模型比较整条编码器的输出。
+用法: python experiments/check_fused_attention.py [--batch 4] [--frames 300] [--repeat 50]
+"""
+import argparse
+import os
+import sys
+import time
+
+import torch
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODEL_DIR = os.path.join(ROOT, "SenseVoiceSmall")
+sys.path.insert(0, MODEL_DIR)
+from model import MultiHeadedAttentionSANM, MultiHeadedAttentionSANMFused, sequence_mask
+
+
+def timeit(fn, repeat):
+    fn()  # 预热
+    t = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - t) / repeat * 1000
+
+
+def check_layer(args, dtype):
+    torch.manual_seed(0)
+    ref = MultiHeadedAttentionSANM(4, 512, 512, 0.1, 11, 0).eval().to(dtype)
+    fused = MultiHeadedAttentionSANMFused(4, 512, 512, 0.1, 11, 0).eval().to(dtype)
+    fused.load_state_dict(ref.state_dict())
+
+    lengths = torch.linspace(args.frames, args.frames // 3, args.batch).long()
+    x = torch.randn(args.batch, args.frames, 512, dtype=dtype)
+    mask = sequence_mask(lengths, dtype=dtype)[:, None, :]
+    valid = mask[:, 0, :, None].bool()
+
+    with torch.no_grad():
+        out_ref = ref(x, mask)
+        out_fused = fused(x, mask)
+        diff = (out_ref - out_fused).float().masked_fill(~valid, 0).abs().max().item()
+        t_ref = timeit(lambda: ref(x, mask), args.repeat)
+        t_fused = timeit(lambda: fused(x, mask), args.repeat)
+    print(
+        f"{str(dtype).replace('torch.', ''):<10}{t_ref:>10.2f}{t_fused:>10.2f}"
+        f"{t_ref / t_fused:>7.2f}x{diff:>12.2e}"
+    )
+
+
+def check_model():
+    from funasr import AutoModel
+
+    def load(attention):
+        return AutoModel(
+            model=MODEL_DIR,
+            trust_remote_code=True,
+            remote_code=os.path.join(MODEL_DIR, "model.py"),
+            device="cpu",
+            disable_update=True,
+            disable_pbar=True,
+            encoder_conf={"selfattention_layer_type": attention},
+        ).model
+
+    ref, fused = load("sanm"), load("sanm_sdpa")
+    torch.manual_seed(0)
+    x = torch.randn(2, 200, 560)
+    lengths = torch.tensor([200, 120])
+    with torch.no_grad():
+        out_ref, _ = ref.encoder(x, lengths)
+        out_fused, _ = fused.encoder(x, lengths)
+    valid = sequence_mask(lengths)[:, :, None].bool()
+    diff = (out_ref - out_fused).masked_fill(~valid, 0).abs().max().item()
+    print(f"\n整条编码器（真实权重）最大差值: {diff:.2e}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch", type=int, default=4)
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--threads", type=int, default=4)
+    args = parser.parse_args()
+    torch.set_num_threads(args.threads)
+
+    print(f"{'精度':<10}{'原实现(ms)':>10}{'融合(ms)':>10}{'加速':>8}{'最大差值':>12}")
+    check_layer(args, torch.float32)
+    check_layer(args, torch.bfloat16)
+
+    if os.path.exists(os.path.join(MODEL_DIR, "model.pt")):
+        check_model()
+
+
+if __name__ == "__main__":
+    main()
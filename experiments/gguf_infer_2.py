@@ -1,23 +1,30 @@
 from llama_cpp import Llama
 import json
+import os
 import re
+import sys
 import time
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from model_memory import memory_report, prefault
+
 # --- 配置 ---
 model_path = "./finetune_model/qwen3_0.6B_q4_k_m.gguf" 
 UNIFIED_INSTRUCTION = "智能家居中控：提取用户指令中的实体与意图，输出标准的JSON控制代码。"
 
 # --- 加载模型 ---
 print("正在加载 GGUF 模型...")
+prefault(model_path)  # 顺序读入页缓存，代替 use_mmap=False 的整体拷贝，避免 SD 卡随机读
 llm = Llama(
     model_path=model_path,
     n_ctx=512,        # 稍微调小一点，够用就行
     n_gpu_layers=0, 
     n_threads=4,       # 树莓派5 物理核心数
     n_batch=512,       
-    use_mmap=False,    # 【修改点】关闭 mmap，强制加载进内存，避免 SD 卡慢速影响//预热效果
+    use_mmap=True,     # 映射文件，权重页面与同时运行的其他进程（如语音助手）共享
     verbose=False      
 )
+print(memory_report({"LLM": model_path}))
 
 def predict(user_input, is_warmup=False):
     messages = [
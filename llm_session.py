@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+"""
+LLM 对话会话：系统提示词的 KV 状态只计算一次。
+
+Qwen 系列 GGUF 使用 ChatML 模板，对话提示词总是以同一段系统提示词开头。
+LLMSession 启动时把系统提示词单独求值一次，用 llama.cpp 的 save_state() 保存
+KV 快照（内存中一份，磁盘上一份，下次启动直接读取）。每轮对话把完整提示词以
+token 序列交给 create_completion：llama.cpp 会跳过与当前 KV 缓存相同的前缀，
+只需预填充本轮新增的用户 token；KV 中的前缀被其他调用覆盖时先恢复快照。
+
+快照文件名由提示词、模型文件指纹、llama_cpp 版本与 n_ctx 共同决定，
+任意一项变化都会重新求值。
+
+Conversation 在此之上保存多轮对话历史。历史同样位于 KV 缓存的前缀中，每轮只预填充
+新的一句话；接近 n_ctx 时删除最早的轮次，并把其后的 KV 整体前移（与 llama.cpp
+命令行的 context shift 相同），不必重新计算剩余的对话。
+
+prefill() 用于投机预填充：用户还在说话时就把流式识别的中间结果写入 KV 缓存，
+中间结果改变时回退到与之相同的 token 前缀再补算，说话结束后只需计算剩余的差异部分。
+"""
+import hashlib
+import os
+import pickle
+
+from model_memory import file_fingerprint
+
+CHATML_STOP = ["<|im_end|>", "<|endoftext|>"]
+
+
+class LLMSession:
+    """
+    以 ChatML 格式生成回复，复用系统提示词的 KV 快照
+
+    Args:
+        llm: llama_cpp.Llama 实例
+        system_prompt: 系统提示词
+        model_path: GGUF 路径，用于快照的缓存键
+        cache_dir: 快照保存目录，None 表示只保存在内存中
+    """
+
+    def __init__(self, llm, system_prompt, model_path, cache_dir=None):
+        self.llm = llm
+        self.system_prompt = system_prompt
+        self.prefix_tokens = self.tokenize_message("system", system_prompt, bos=True)
+        self.state = None
+
+        import llama_cpp
+
+        key = "|".join([
+            system_prompt, file_fingerprint(model_path), llama_cpp.__version__, str(llm.n_ctx()),
+        ])
+        key = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+        self.cache_path = os.path.join(cache_dir, f"system_{key}.state") if cache_dir else None
+
+    def tokenize_message(self, role, content, bos=False):
+        """<|im_start|>role\\ncontent<|im_end|>\\n；正文按普通文本切分，不解析特殊 token"""
+        return (
+            self.llm.tokenize(f"<|im_start|>{role}\n".encode("utf-8"), add_bos=bos, special=True)
+            + self.llm.tokenize(content.encode("utf-8"), add_bos=False, special=False)
+            + self.llm.tokenize(b"<|im_end|>\n", add_bos=False, special=True)
+        )
+
+    def prepare(self):
+        """读取磁盘快照，不存在或失效时求值系统提示词并保存，返回是否命中磁盘缓存"""
+        if self.cache_path and os.path.exists(self.cache_path):
+            try:
+                with open(self.cache_path, "rb") as f:
+                    state = pickle.load(f)
+                if list(state.input_ids[: state.n_tokens]) == self.prefix_tokens:
+                    self.state = state
+                    self.llm.load_state(state)
+                    return True
+            except Exception as e:
+                print(f" -> [警告] 系统提示词快照无法读取，重新计算: {e}")
+
+        self.llm.reset()
+        self.llm.eval(self.prefix_tokens)
+        self.state = self.llm.save_state()
+        if self.cache_path:
+            try:
+                os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+                with open(self.cache_path + ".tmp", "wb") as f:
+                    pickle.dump(self.state, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(self.cache_path + ".tmp", self.cache_path)
+            except OSError as e:
+                print(f" -> [警告] 系统提示词快照保存失败: {e}")
+        return False
+
+    def restore_prefix(self):
+        """KV 缓存开头不再是系统提示词时恢复快照"""
+        n = len(self.prefix_tokens)
+        if self.llm.n_tokens >= n and list(self.llm.input_ids[:n]) == self.prefix_tokens:
+            return
+        self.llm.load_state(self.state)
+
+    def discard(self, start, tokens):
+        """
+        从 KV 缓存中删除位置 start 起的 tokens，其后的 KV 前移补上空位
+
+        KV 中该区间与 tokens 不一致、llama_cpp 不支持平移或删除失败（返回 False）时，
+        只保留 start 之前的部分，之后的内容由下一次生成重新计算。
+        """
+        llm = self.llm
+        n, end = llm.n_tokens, start + len(tokens)
+        if n <= start:
+            return
+        if n < end or list(llm.input_ids[start:end]) != list(tokens):
+            llm.n_tokens = start
+            return
+        try:
+            # 旧版本没有返回值 (None)；返回 False 表示没有删除，KV 与 input_ids 不能再按平移处理
+            if llm._ctx.kv_cache_seq_rm(0, start, end) is False:
+                llm.n_tokens = start
+                return
+            llm._ctx.kv_cache_seq_shift(0, end, n, start - end)
+        except AttributeError:
+            llm.n_tokens = start
+            return
+        llm.input_ids[start : n - len(tokens)] = llm.input_ids[end:n].copy()
+        llm.n_tokens = n - len(tokens)
+
+    def prefill(self, messages):
+        """
+        预先求值提示词，最后一条消息不含结尾，内容还可以继续增长
+
+        Returns:
+            int: 本次实际计算的 token 数
+        """
+        llm = self.llm
+        tokens = self.prompt_tokens(messages)[: -self.n_closing_tokens]
+        if self.state is not None and tokens[: len(self.prefix_tokens)] == self.prefix_tokens:
+            self.restore_prefix()
+        n = 0
+        for cached, token in zip(llm.input_ids[: llm.n_tokens], tokens):
+            if cached != token:
+                break
+            n += 1
+        llm.n_tokens = n  # 与新提示词不同的部分丢弃，eval 时从这里接着算
+        if n < len(tokens):
+            llm.eval(tokens[n:])
+        return len(tokens) - n
+
+    @property
+    def n_closing_tokens(self):
+        """最后一条消息结尾与 assistant 开头的 token 数"""
+        return len(self.llm.tokenize(b"<|im_end|>\n", add_bos=False, special=True)) + len(
+            self.llm.tokenize(b"<|im_start|>assistant\n", add_bos=False, special=True)
+        )
+
+    def prompt_tokens(self, messages):
+        """ChatML 提示词的 token 序列，以 assistant 开头结尾等待生成"""
+        tokens = []
+        for message in messages:
+            if not tokens and message["role"] == "system" and message["content"] == self.system_prompt:
+                tokens = list(self.prefix_tokens)
+                continue
+            tokens += self.tokenize_message(message["role"], message["content"], bos=not tokens)
+        return tokens + self.llm.tokenize(b"<|im_start|>assistant\n", add_bos=False, special=True)
+
+    def chat(self, messages, stream=False, **kwargs):
+        """
+        用法与返回格式同 Llama.create_chat_completion（choices[0]['message'] / ['delta']）
+        调用方负责加锁，同一时间只能有一个生成在进行
+        """
+        tokens = self.prompt_tokens(messages)
+        if self.state is not None and tokens[: len(self.prefix_tokens)] == self.prefix_tokens:
+            self.restore_prefix()
+        kwargs.setdefault("stop", CHATML_STOP)
+        output = self.llm.create_completion(prompt=tokens, stream=stream, **kwargs)
+        if stream:
+            return _chat_chunks(output)
+        choice = output["choices"][0]
+        output["choices"] = [{
+            "index": 0,
+            "message": {"role": "assistant", "content": choice["text"]},
+            "finish_reason": choice["finish_reason"],
+        }]
+        return output
+
+
+class Conversation:
+    """
+    多轮对话历史
+
+    Args:
+        session: LLMSession
+        max_turns: 最多保留的历史轮数，0 表示每轮只发送系统提示词和当前的话
+    """
+
+    def __init__(self, session, max_turns=0):
+        self.session = session
+        self.max_turns = max_turns
+        self.turns = []  # [(用户的话, 回复)]
+
+    def messages(self, user_text):
+        messages = [{"role": "system", "content": self.session.system_prompt}]
+        for user, reply in self.turns:
+            messages.append({"role": "user", "content": user})
+            messages.append({"role": "assistant", "content": reply})
+        messages.append({"role": "user", "content": user_text})
+        return messages
+
+    def evict_oldest(self):
+        """删除最早的一轮，同时从 KV 缓存中移除它"""
+        user, reply = self.turns.pop(0)
+        session = self.session
+        session.discard(
+            len(session.prefix_tokens),
+            session.tokenize_message("user", user) + session.tokenize_message("assistant", reply),
+        )
+
+    def fit(self, user_text, max_tokens):
+        """丢弃最早的轮次，直到历史不超过 max_turns 且提示词加上最长回复放得进上下文窗口"""
+        n_ctx = self.session.llm.n_ctx()
+        while len(self.turns) > self.max_turns:
+            self.evict_oldest()
+        while self.turns and len(self.session.prompt_tokens(self.messages(user_text))) + max_tokens > n_ctx:
+            self.evict_oldest()
+
+    def chat(self, user_text, stream=False, max_tokens=256, **kwargs):
+        """生成回复，参数与返回格式同 LLMSession.chat；回复结束后调用 record() 记入历史"""
+        self.fit(user_text, max_tokens)
+        return self.session.chat(self.messages(user_text), stream=stream, max_tokens=max_tokens, **kwargs)
+
+    def prefill(self, partial_text, max_tokens=256):
+        """以识别中间结果作为本轮的话预填充，返回实际计算的 token 数"""
+        self.fit(partial_text, max_tokens)
+        return self.session.prefill(self.messages(partial_text))
+
+    def record(self, user_text, reply):
+        """记入一轮对话；被打断时 reply 为已生成的部分"""
+        if self.max_turns > 0 and reply:
+            self.turns.append((user_text, reply))
+
+    def clear(self):
+        self.turns.clear()
+
+
+def _chat_chunks(stream):
+    """把文本补全的流式输出转换为 chat 格式的 delta；close() 时一并结束 llama.cpp 的生成"""
+    try:
+        for chunk in stream:
+            choice = chunk["choices"][0]
+            yield {
+                "choices": [{
+                    "index": 0,
+                    "delta": {"content": choice["text"]},
+                    "finish_reason": choice["finish_reason"],
+                }]
+            }
+    finally:
+        stream.close()
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+模型文件工具（Linux）：文件指纹、文件预读、mlock 检查与常驻/共享内存统计。
+
+GGUF 以 mmap 方式加载时，权重页面属于页缓存，多个进程映射同一文件只占一份物理内存；
+代价是页面按需从 SD 卡读入。prefault() 启动时顺序读一遍文件把它放进页缓存，
+之后的缺页都是不涉及 IO 的轻微缺页。memory_report() 从 /proc/self/smaps 统计
+某个文件映射的常驻 (Rss)、共享 (Shared) 与私有 (Private) 内存。
+"""
+import hashlib
+import os
+
+_PROC_STATUS_KEYS = ("VmRSS", "RssAnon", "RssFile", "VmLck")
+_SMAPS_FIELDS = {
+    "Size": "size",
+    "Rss": "rss",
+    "Shared_Clean": "shared",
+    "Shared_Dirty": "shared",
+    "Private_Clean": "private",
+    "Private_Dirty": "private",
+    "Locked": "locked",
+}
+
+
+def file_fingerprint(path):
+    """模型文件的大小、修改时间及首尾各 1MB 的 SHA-1，启动时计算也很快，用作缓存键"""
+    stat = os.stat(path)
+    parts = [str(stat.st_size), str(stat.st_mtime_ns)]
+    with open(path, "rb") as f:
+        parts.append(hashlib.sha1(f.read(1 << 20)).hexdigest())
+        f.seek(max(stat.st_size - (1 << 20), 0))
+        parts.append(hashlib.sha1(f.read()).hexdigest())
+    return "|".join(parts)
+
+
+def prefault(path, chunk_mb=8):
+    """顺序读取整个文件进页缓存，返回读取的字节数"""
+    total = 0
+    buf = bytearray(chunk_mb << 20)
+    with open(path, "rb", buffering=0) as f:
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                break
+            total += n
+    return total
+
+
+def check_mlock(path):
+    """mlock 整个文件所需的额度是否足够，不足时返回提示文本，否则返回 None"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    soft, _ = resource.getrlimit(resource.RLIMIT_MEMLOCK)
+    size = os.path.getsize(path)
+    if soft != resource.RLIM_INFINITY and soft < size:
+        return (
+            f"RLIMIT_MEMLOCK={soft >> 20}MB 小于模型 {size >> 20}MB，mlock 会失败，"
+            f"请调大 ulimit -l 或在 /etc/security/limits.conf 中设置 memlock"
+        )
+    return None
+
+
+def mapping_usage(path):
+    """
+    统计当前进程中 path 的文件映射，单位字节
+
+    shared 为同时被其他进程映射的页面；private 为目前只有本进程映射的页面，
+    对只读的文件映射它们仍是页缓存，其他进程映射同一文件时会直接共享。
+
+    Returns:
+        dict: {"size", "rss", "shared", "private", "locked"}，未映射时为 None
+    """
+    path = os.path.realpath(path)
+    usage = None
+    in_mapping = False
+    try:
+        with open("/proc/self/smaps") as f:
+            for line in f:
+                fields = line.split()
+                if not fields:
+                    continue
+                if not fields[0].endswith(":"):
+                    # 映射头: 地址 权限 偏移 设备 inode 路径
+                    in_mapping = len(fields) >= 6 and fields[5] == path
+                    if in_mapping and usage is None:
+                        usage = dict(size=0, rss=0, shared=0, private=0, locked=0)
+                    continue
+                field = _SMAPS_FIELDS.get(fields[0][:-1])
+                if in_mapping and field is not None:
+                    usage[field] += int(fields[1]) * 1024
+    except OSError:
+        return None
+    return usage
+
+
+def process_usage():
+    """/proc/self/status 中的进程级内存，单位字节"""
+    usage = {}
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in _PROC_STATUS_KEYS:
+                    usage[key] = int(value.split()[0]) * 1024
+    except OSError:
+        pass
+    return usage
+
+
+def memory_report(models):
+    """
+    格式化内存报告
+
+    Args:
+        models: {名称: GGUF 路径或已加载权重的字节数}；路径按文件映射统计，
+            字节数视为进程私有内存（如 torch 加载的 ASR 权重）
+    """
+    mb = lambda n: f"{n / (1 << 20):7.1f}MB"
+    lines = []
+    for name, model in models.items():
+        if isinstance(model, int):
+            lines.append(f"    {name:<8} 私有 {mb(model)} (进程内加载，不共享)")
+            continue
+        usage = mapping_usage(model)
+        if usage is None:
+            lines.append(f"    {name:<8} 未映射 (use_mmap=False，权重在进程私有内存中)")
+        else:
+            lines.append(
+                f"    {name:<8} 常驻 {mb(usage['rss'])} 共享 {mb(usage['shared'])} "
+                f"仅本进程 {mb(usage['private'])} 锁定 {mb(usage['locked'])} / 文件 {mb(usage['size'])}"
+            )
+    total = process_usage()
+    if total:
+        lines.append(
+            "    进程     " + " ".join(f"{key} {mb(value)}" for key, value in total.items())
+        )
+    return "\n".join(lines)
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""
+常用语音指令的回复缓存。
+
+智能家居等场景中同样的指令反复出现（"打开客厅的灯"、"把空调关了"）。
+以规范化后的识别文本为键缓存 LLM 回复，可选同时缓存合成好的 PCM（int16），
+命中时跳过 LLM 与 TTS，毫秒级给出回复。按 LRU 淘汰、按 TTL 过期，
+并统计命中/未命中次数。
+
+持久化时每个条目单独一个文件，由后台线程写入：新增一条只写这一条，
+调用方不必等待 SD 卡 IO；重启时读取目录恢复，文件修改时间即最近使用时间。
+"""
+import hashlib
+import os
+import pickle
+import queue
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+
+
+def normalize_key(text):
+    """全角转半角、去掉标点与空白、英文转小写："打开 客厅的灯！" -> "打开客厅的灯" """
+    text = unicodedata.normalize("NFKC", text)
+    return re.sub(r"[\W_]+", "", text).lower()
+
+
+def to_int16(pcm):
+    """float PCM ([-1, 1]) -> int16，体积减半，播放器可直接播放"""
+    pcm = np.asarray(pcm)
+    if pcm.dtype == np.int16:
+        return pcm
+    return (np.clip(pcm, -1.0, 1.0) * 32767.0).astype(np.int16)
+
+
+class ResponseCache:
+    """
+    LRU + TTL 回复缓存，线程安全
+
+    Args:
+        max_entries: 最多缓存的条目数，超出时淘汰最久未使用的
+        ttl: 条目有效期（秒），None 为不过期
+        cache_dir: 持久化目录，每条一个文件；None 表示只保存在内存中
+    """
+
+    def __init__(self, max_entries=256, ttl=None, cache_dir=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (写入时间, 回复, [(int16 pcm, sample_rate)] 或 None)
+        self._lock = threading.Lock()
+        self._writes = queue.Queue()
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            self.load()
+            threading.Thread(target=self._writer, daemon=True).start()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, text):
+        """
+        Returns:
+            (reply, speech) 或 None；speech 为逐句的 [(int16 pcm, sample_rate)]，未缓存音频时为 None
+        """
+        key = normalize_key(text)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry):
+                del self._entries[key]
+                self._persist("delete", key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            self._persist("touch", key)
+            return entry[1], entry[2]
+
+    def put(self, text, reply, speech=None):
+        key = normalize_key(text)
+        if not key or not reply:
+            return
+        if speech is not None:
+            speech = [(to_int16(pcm), sample_rate) for pcm, sample_rate in speech]
+        entry = (time.time(), reply, speech)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            self._persist("write", key, entry)
+            while len(self._entries) > self.max_entries:
+                evicted, _ = self._entries.popitem(last=False)
+                self._persist("delete", evicted)
+
+    def clear(self):
+        with self._lock:
+            for key in self._entries:
+                self._persist("delete", key)
+            self._entries.clear()
+
+    def flush(self):
+        """等待后台写入完成（退出前调用）"""
+        if self.cache_dir:
+            self._writes.join()
+
+    def stats(self):
+        total = self.hits + self.misses
+        rate = self.hits / total if total else 0.0
+        return f"命中 {self.hits}/{total} ({rate:.0%})，{len(self._entries)} 条"
+
+    def _expired(self, entry):
+        return self.ttl is not None and time.time() - entry[0] > self.ttl
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode("utf-8")).hexdigest()[:16] + ".pkl")
+
+    def _persist(self, op, key, entry=None):
+        if self.cache_dir:
+            self._writes.put((op, key, entry))
+
+    def _writer(self):
+        """后台写盘：每条原子写入单独的文件，失败只打印警告"""
+        while True:
+            op, key, entry = self._writes.get()
+            path = self._entry_path(key)
+            try:
+                if op == "write":
+                    with open(path + ".tmp", "wb") as f:
+                        pickle.dump((key,) + entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+                    os.replace(path + ".tmp", path)
+                elif op == "touch":
+                    os.utime(path)
+                elif op == "delete":
+                    os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"[回复缓存] 保存失败: {e}")
+            finally:
+                self._writes.task_done()
+
+    def load(self):
+        """读取持久化目录，按最近使用时间恢复 LRU 顺序，过期与多出的条目删除"""
+        files = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".pkl"):
+                path = os.path.join(self.cache_dir, name)
+                files.append((os.path.getmtime(path), path))
+        files.sort()
+        for _, path in files:
+            try:
+                with open(path, "rb") as f:
+                    key, *entry = pickle.load(f)
+            except Exception as e:
+                print(f"[回复缓存] 跳过无法读取的条目 {path}: {e}")
+                continue
+            if self._expired(entry):
+                os.remove(path)
+                continue
+            self._entries[key] = tuple(entry)
+        while len(self._entries) > self.max_entries:
+            evicted, _ = self._entries.popitem(last=False)
+            os.remove(self._entry_path(evicted))
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+SenseVoice 流式识别。
+
+录音过程中把麦克风音频块不断送入后台线程，由 SenseVoiceSmall.inference_chunk
+按块编码（逐层 k/v 与 FSMN 缓存），并给出 CTC 中间结果。
+检测到说话结束时只剩最后一小段需要计算，识别结果几乎立即可用。
+"""
+import queue
+import threading
+
+import numpy as np
+import torch
+
+
+class StreamingASR:
+    """
+    单句流式识别会话：feed() 送入音频，finish() 取最终结果，cancel() 放弃
+
+    Args:
+        asr_model: funasr AutoModel（SenseVoiceSmall）
+        sample_rate: 送入音频的采样率，内部重采样到 16k
+        chunk_size: [左上下文, 块长, 前瞻]，单位为 LFR 帧 (60ms)
+        look_back: 注意力回看的块数，-1 为全部
+        on_partial: 可选回调，每得到新的中间结果时以文本调用
+    """
+
+    def __init__(
+        self,
+        asr_model,
+        sample_rate=16000,
+        chunk_size=(0, 10, 5),
+        look_back=-1,
+        language="auto",
+        use_itn=False,
+        on_partial=None,
+    ):
+        self.model = asr_model.model
+        self.kwargs = dict(asr_model.kwargs)
+        for name in ("cache", "is_final", "chunk_size", "look_back"):
+            self.kwargs.pop(name, None)
+        self.kwargs.update(fs=sample_rate, language=language, use_itn=use_itn)
+        self.chunk_size = list(chunk_size)
+        self.look_back = look_back
+        self.on_partial = on_partial
+
+        self.cache = {}
+        self.text = ""
+        self.audio_queue = queue.Queue()
+        self.result = None
+        self.done = threading.Event()
+        self.thread = threading.Thread(target=self._worker, daemon=True)
+        self.thread.start()
+
+    def feed(self, data):
+        """送入一块 int16 PCM 字节流"""
+        self.audio_queue.put(data)
+
+    def finish(self, timeout=None):
+        """声明说话结束，等待并返回最终识别文本"""
+        self.audio_queue.put(None)
+        self.done.wait(timeout)
+        return self.result
+
+    def cancel(self):
+        """丢弃本次会话（录音过短或被打断）"""
+        self.audio_queue.put(False)
+
+    def _worker(self):
+        try:
+            while True:
+                item = self.audio_queue.get()
+                if item is False:
+                    return
+                is_final = item is None
+                chunks = [] if is_final else [item]
+                # 积压的音频合并成一次调用，推理跟不上时也不会越拖越久
+                while not is_final:
+                    try:
+                        item = self.audio_queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is False:
+                        return
+                    if item is None:
+                        is_final = True
+                    else:
+                        chunks.append(item)
+
+                audio = np.frombuffer(b"".join(chunks), dtype=np.int16).astype(np.float32)
+                audio /= 32768.0
+                text = self._decode(audio, is_final)
+                if is_final:
+                    self.result = text
+                    return
+                if text != self.text:
+                    self.text = text
+                    if self.on_partial is not None:
+                        self.on_partial(text)
+        except Exception as e:
+            print(f"[流式 ASR Error] {e}")
+        finally:
+            self.done.set()
+
+    def _decode(self, audio, is_final):
+        with torch.no_grad():
+            res, _ = self.model.inference_chunk(
+                audio,
+                self.cache,
+                is_final=is_final,
+                chunk_size=self.chunk_size,
+                look_back=self.look_back,
+                **self.kwargs,
+            )
+        return res[0]["text"]
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+可插拔的 TTS 引擎。
+
+所有引擎实现同一个接口 synthesize(text) -> (pcm, sample_rate)，
+pcm 为 float32 单声道 numpy 数组，取值 [-1, 1]，不再产生中间 mp3 文件。
+
+- PiperTTSEngine: 本地离线合成。加载 Piper/VITS 导出的 onnx 模型，
+  通过 SenseVoiceSmall/utils 中的 OrtInferSession 在 CPU 上推理。
+- EdgeTTSEngine:  微软 Edge 在线合成（需联网），mp3 在内存中解码为 PCM。
+"""
+import asyncio
+import io
+import json
+import os
+import sys
+import unicodedata
+
+import numpy as np
+
+
+class TTSEngine:
+    """TTS 引擎基类"""
+
+    name = "base"
+
+    def synthesize(self, text):
+        """
+        合成一段文本
+
+        Args:
+            text: 待合成文本
+
+        Returns:
+            (pcm, sample_rate): float32 单声道数组及其采样率
+        """
+        raise NotImplementedError
+
+
+def _load_ort_session(model_path, num_threads):
+    # 与 SenseVoice 的 onnx 推理共用同一个 OrtInferSession 封装
+    sensevoice_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "SenseVoiceSmall")
+    if sensevoice_dir not in sys.path:
+        sys.path.insert(0, sensevoice_dir)
+    from utils.infer_utils import OrtInferSession
+
+    return OrtInferSession(model_path, device_id=-1, intra_op_num_threads=num_threads)
+
+
+class PiperTTSEngine(TTSEngine):
+    """
+    本地 Piper (VITS) onnx 模型
+
+    模型目录结构与 Piper 官方发布一致：
+        xxx.onnx        # 模型
+        xxx.onnx.json   # 配置（采样率、音素表、推理参数）
+    phoneme_type 为 "espeak" 的模型需要安装 piper-phonemize。
+    """
+
+    name = "piper"
+
+    BOS, EOS, PAD = "^", "$", "_"
+
+    def __init__(self, model_path, config_path=None, speaker_id=0, num_threads=4):
+        config_path = config_path or f"{model_path}.json"
+        with open(config_path, "r", encoding="utf-8") as f:
+            config = json.load(f)
+
+        self.sample_rate = config["audio"]["sample_rate"]
+        self.phoneme_type = config.get("phoneme_type", "espeak")
+        self.espeak_voice = config.get("espeak", {}).get("voice", "cmn")
+        self.phoneme_id_map = config["phoneme_id_map"]
+        self.num_speakers = config.get("num_speakers", 1)
+        self.speaker_id = speaker_id
+
+        inference = config.get("inference", {})
+        self.scales = np.array(
+            [
+                inference.get("noise_scale", 0.667),
+                inference.get("length_scale", 1.0),
+                inference.get("noise_w", 0.8),
+            ],
+            dtype=np.float32,
+        )
+
+        self.session = _load_ort_session(model_path, num_threads)
+
+    def phonemize(self, text):
+        """文本 -> 音素列表（每个子句一个列表）"""
+        if self.phoneme_type == "text":
+            return [list(unicodedata.normalize("NFD", text))]
+
+        from piper_phonemize import phonemize_espeak
+
+        return phonemize_espeak(text, self.espeak_voice)
+
+    def phonemes_to_ids(self, phonemes):
+        id_map = self.phoneme_id_map
+        ids = list(id_map[self.BOS])
+        for phoneme in phonemes:
+            if phoneme not in id_map:
+                continue
+            ids.extend(id_map[phoneme])
+            ids.extend(id_map[self.PAD])
+        ids.extend(id_map[self.EOS])
+        return ids
+
+    def synthesize(self, text):
+        chunks = []
+        for phonemes in self.phonemize(text):
+            ids = self.phonemes_to_ids(phonemes)
+            text_ids = np.array(ids, dtype=np.int64)[None, :]
+            text_lengths = np.array([text_ids.shape[1]], dtype=np.int64)
+            inputs = [text_ids, text_lengths, self.scales]
+            if self.num_speakers > 1:
+                inputs.append(np.array([self.speaker_id], dtype=np.int64))
+            audio = self.session(inputs)[0]
+            chunks.append(audio.reshape(-1).astype(np.float32))
+
+        if not chunks:
+            return np.zeros(0, dtype=np.float32), self.sample_rate
+        return np.concatenate(chunks), self.sample_rate
+
+
+class EdgeTTSEngine(TTSEngine):
+    """微软 Edge 在线 TTS（需联网），合成结果在内存中解码为 PCM"""
+
+    name = "edge"
+
+    # Edge 默认输出 audio-24khz-48kbitrate-mono-mp3
+    sample_rate = 24000
+
+    def __init__(self, voice="zh-CN-XiaoyiNeural"):
+        self.voice = voice
+
+    async def _fetch_mp3(self, text):
+        import edge_tts
+
+        communicate = edge_tts.Communicate(text, self.voice)
+        mp3 = bytearray()
+        async for chunk in communicate.stream():
+            if chunk["type"] == "audio":
+                mp3.extend(chunk["data"])
+        return bytes(mp3)
+
+    def synthesize(self, text):
+        import soundfile as sf
+
+        mp3 = asyncio.run(self._fetch_mp3(text))
+        pcm, sample_rate = sf.read(io.BytesIO(mp3), dtype="float32")
+        if pcm.ndim > 1:
+            pcm = pcm.mean(axis=1)
+        return pcm, sample_rate
+
+
+TTS_ENGINES = {
+    PiperTTSEngine.name: PiperTTSEngine,
+    EdgeTTSEngine.name: EdgeTTSEngine,
+}
+
+
+def create_tts_engine(name, **kwargs):
+    """按名字创建 TTS 引擎，kwargs 原样传给对应引擎的构造函数"""
+    if name not in TTS_ENGINES:
+        raise ValueError(f"未知的 TTS 引擎: {name}，可选: {list(TTS_ENGINES)}")
+    return TTS_ENGINES[name](**kwargs)
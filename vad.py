@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+麦克风流上的语音活动检测 (VAD)。
+
+把任意长度的 int16 音频块切成 webrtcvad 要求的 10/20/30 ms 帧逐帧判断，
+同时叠加音量门限：播放回复时扬声器的回声也会被 VAD 当成语音，
+提高门限并要求连续多帧命中即可过滤大部分回声。
+未安装 webrtcvad 时退化为纯音量检测。
+"""
+import numpy as np
+
+try:
+    import webrtcvad
+except ImportError:
+    webrtcvad = None
+
+
+class SpeechDetector:
+    """
+    流式语音检测器
+
+    Args:
+        sample_rate: 采样率，webrtcvad 仅支持 8000/16000/32000/48000
+        frame_ms: VAD 帧长，10/20/30
+        mode: webrtcvad 激进程度 0-3，越大越不容易把噪声判成语音
+    """
+
+    def __init__(self, sample_rate, frame_ms=30, mode=3):
+        self.sample_rate = sample_rate
+        self.frame_samples = int(sample_rate * frame_ms / 1000)
+        self.frame_bytes = self.frame_samples * 2
+        self.vad = None
+        if webrtcvad is not None:
+            self.vad = webrtcvad.Vad(mode)
+        self.remainder = b""
+        self.speech_run = 0  # 连续语音帧数
+
+    def reset(self):
+        self.remainder = b""
+        self.speech_run = 0
+
+    def is_speech(self, frame, min_volume):
+        volume = np.mean(np.abs(np.frombuffer(frame, dtype=np.int16)))
+        if volume <= min_volume:
+            return False
+        if self.vad is None:
+            return True
+        return self.vad.is_speech(frame, self.sample_rate)
+
+    def update(self, data, min_volume, min_frames=1):
+        """
+        送入一块音频，逐帧判断
+
+        Args:
+            data: int16 PCM 字节流
+            min_volume: 本次判定使用的音量门限（平均绝对值）
+            min_frames: 连续多少帧判为语音即算检测到
+
+        Returns:
+            bool: 本块中是否有某一帧使连续语音帧数达到 min_frames
+                （逐帧检查，块内随后的静音帧不会把它抵消）
+        """
+        buf = self.remainder + data
+        n_frames = len(buf) // self.frame_bytes
+        detected = False
+        for i in range(n_frames):
+            frame = buf[i * self.frame_bytes : (i + 1) * self.frame_bytes]
+            if self.is_speech(frame, min_volume):
+                self.speech_run += 1
+                detected |= self.speech_run >= min_frames
+            else:
+                self.speech_run = 0
+        self.remainder = buf[n_frames * self.frame_bytes :]
+        return detected
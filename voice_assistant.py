@@ -1,24 +1,47 @@
-import pyaudio
+import time
+_PROCESS_START = time.time()  # 启动计时起点
+
 import wave
 import threading
 import numpy as np
-import time
 import os
-import pygame
-import edge_tts
-import asyncio
 import traceback
 import re
-from funasr import AutoModel
-from llama_cpp import Llama
+import queue
+from collections import deque
+from contextlib import contextmanager
+from tts_engines import create_tts_engine
+from vad import SpeechDetector
+from asr_server import ASRClient
+from model_memory import check_mlock, memory_report, prefault
+from llm_session import Conversation, LLMSession
+from response_cache import ResponseCache
+# funasr / torch、llama_cpp、pyaudio、sounddevice 导入较慢，在各自的加载线程或首次使用时再导入
  
 
 # --- 配置类 ---
 class Config:
     OUTPUT_DIR = "./output"
     MODEL_DIR_SENSEVOICE = "./SenseVoiceSmall"
+    # 常驻 ASR 服务地址（python asr_server.py 启动），设置后不在本进程加载 SenseVoice
+    # 例如 "http://127.0.0.1:10095"；None 表示本地加载
+    ASR_SERVER_URL = None
     # 你的 GGUF 模型路径
     MODEL_PATH_LLM = "./qwen3-0.6B-gguf/qwen3_0.6B_q4_k_m.gguf"
+    # mmap 加载 GGUF：权重留在页缓存中，同时运行的多个进程只占一份内存
+    LLM_USE_MMAP = True
+    LLM_PREFAULT = True           # 加载前顺序读一遍文件进页缓存，避免首轮从 SD 卡缺页
+    LLM_MLOCK = False             # 锁定权重页面不被换出 (需 ulimit -l 不小于模型大小)
+    # 系统提示词只在启动时求值一次，KV 快照缓存到 LLM_PROMPT_CACHE_DIR，每轮只预填充用户的话
+    # 快照按提示词和模型文件区分，任一改动后自动重新计算
+    LLM_PROMPT_CACHE = True
+    LLM_PROMPT_CACHE_DIR = "./qwen3-0.6B-gguf/prompt_cache"
+    # 多轮对话：保留最近几轮历史，历史留在 KV 缓存中不重复计算；0 为不记忆上文
+    # 接近上下文窗口 (n_ctx=1024) 时丢弃最早的轮次，其后的 KV 平移复用
+    LLM_HISTORY_TURNS = 4
+    # 投机预填充（需开启 ASR_STREAMING）：说话期间就把识别中间结果预填充进 LLM，
+    # 说完后只需回退并补算与最终结果不同的 token，预填充耗时大多藏在 SILENCE_TIMEOUT 的等待里
+    LLM_SPECULATIVE_PREFILL = False
     
     DEVICE = "cpu" 
     
@@ -34,11 +57,111 @@ class Config:
     # 静音等待时间：说完话后停顿多久算结束
     # 静音自动关闭时间：说完话间隔SILENCE_TIMEOUT秒后自动关闭录音
     SILENCE_TIMEOUT = 1.0  
+
+    # 调试录音：开启后每段语音额外保存为 ./output/audio_N.wav
+    # 默认关闭，录音直接以 numpy 数组送入 ASR，不落盘
+    DEBUG_SAVE_AUDIO = False
+
+    # --- 流式识别 ---
+    # 开启后边录音边识别：SenseVoice 按块编码并缓存各层状态，说话结束时只需算最后一小段
+    ASR_STREAMING = False
+    ASR_CHUNK_SIZE = [0, 10, 5]   # [左上下文, 块长, 前瞻]，单位 60ms
+    ASR_LOOK_BACK = -1            # 注意力回看块数，-1 为整句
+    # 默认直接采用流式最终结果，说话结束后只需算最后一小段；
+    # 设为 True 改为整句离线再识别一遍（流式中间结果仍用于预填充），要多等一次完整推理，
+    # 两者的字错率与延迟可用 experiments/bench_asr_streaming.py 在自己的录音上对比后再决定
+    ASR_STREAMING_OFFLINE_FINAL = False
+    # 把 CMVN 折叠进编码器输入缩放 (x*sqrt(d) -> x*scale+shift)，前端不再单独做归一化
+    ASR_FOLD_CMVN = False
+    # INT8 动态量化：编码器与 CTC 的全部 Linear 以 int8 权重推理，CPU 上更快、更省内存
+    # 精度/延迟对比见 experiments/bench_asr_quant.py
+    ASR_QUANTIZE = False
+    # 推理精度："float32"，或在支持 bf16 的 CPU 上用 "bfloat16"（与 ASR_QUANTIZE 二选一）
+    ASR_PRECISION = "float32"
+    # 编码器注意力实现："sanm" 为原实现，"sanm_sdpa" 使用 scaled_dot_product_attention 融合实现
+    # 两者权重通用，数值一致性见 experiments/check_fused_attention.py
+    ASR_ATTENTION = "sanm"
+    # 快速模式：以少量精度换延迟，取舍曲线见 experiments/bench_asr_fast.py
+    ASR_TP_BLOCKS = None          # 只跑前 N 个 tp 块 (共 20 个)，None 为全部
+    ASR_EXIT_THRESHOLD = None     # 第 10 个 tp 块后 CTC 置信度都不低于该值即提前结束，如 0.9
+    # 把编码器 + CTC 头 trace 成 TorchScript 并冻结，计算图（不含权重）缓存到 ASR_COMPILE_CACHE，
+    # 之后启动直接加载；快速模式、打包合批与流式识别仍走原模块
+    ASR_COMPILE = False
+    ASR_COMPILE_CACHE = "./SenseVoiceSmall/compiled"
+
+    # --- 流式播报 ---
+    # 开启后 LLM 边生成边按标点切句，每句立即送去合成、播放，不必等整段回复生成完
+    STREAM_TTS = True
+    SENTENCE_QUEUE_SIZE = 8    # 待合成句子队列上限
+    MIN_SENTENCE_CHARS = 4     # 过短的片段并入下一句，避免逐字合成
+
+    # --- TTS 引擎 ---
+    # "piper": 本地离线合成（onnx 模型，CPU 推理，无需联网）
+    # "edge":  微软 Edge 在线合成（需联网）
+    # piper 模型文件不存在时自动回退到 edge
+    TTS_ENGINE = "piper"
+    TTS_MODEL_PATH = "./tts_models/zh_CN-huayan-medium.onnx"   # 配置文件为同名 .onnx.json
+    TTS_VOICE = "zh-CN-XiaoyiNeural"                           # edge 音色
+
+    # --- 播放 ---
+    # PCM 直接写入环形缓冲区，由声卡回调连续播放，句与句之间无间隙
+    PLAYBACK_RATE = None            # None 表示使用 TTS 引擎的原生采样率，免去重采样
+    PLAYBACK_BUFFER_SECONDS = 20.0  # 环形缓冲区容量，写满时 TTS 线程等待
+
+    # --- 回复缓存 ---
+    # 常用指令（如智能家居控制）以规范化后的识别文本为键缓存回复与合成音频，再次说到时跳过 LLM 与 TTS
+    # 回复依赖上下文或时间的闲聊场景不建议开启
+    RESPONSE_CACHE = False
+    RESPONSE_CACHE_SIZE = 256             # 最多缓存条数，超出时淘汰最久未用的
+    RESPONSE_CACHE_TTL = 7 * 24 * 3600    # 有效期 (秒)，None 为不过期
+    RESPONSE_CACHE_AUDIO = True           # 同时缓存合成好的 PCM (int16)
+    RESPONSE_CACHE_DIR = "./output/response_cache"  # 持久化目录，每条一个文件，后台写入，重启后继续使用
+
+    # --- 打断 (barge-in) ---
+    # 回复期间持续对麦克风做 VAD，用户一开口就停止生成、合成和播放，立即开始新一轮录音
+    BARGE_IN = True
+    VAD_MODE = 3                 # webrtcvad 激进程度 0-3
+    VAD_FRAME_MS = 30            # VAD 帧长
+    BARGE_IN_MIN_VOLUME = 1500   # 播放中的打断音量门限，高于 MIN_VOLUME 以容忍扬声器回声
+    BARGE_IN_FRAMES = 2          # 连续多少个 VAD 帧判为语音才打断 (2 x 30ms)；回声误触发时调大
+    PREROLL_CHUNKS = 3           # 打断时一并送入新一轮的历史音频时长 (以 CHUNK 计)，保留开口部分
     
     SYSTEM_PROMPT = "你叫千问，是一个18岁的女大学生，性格活泼开朗。请用简短的语言回答（50字以内）。注意：不需要思考，直接输出。"
 
 os.environ["OMP_NUM_THREADS"] = "4"
 
+# 切句标点：中文句末标点 + 英文标点 + 换行
+SENTENCE_DELIMITERS = set("。！？；，!?;,.\n")
+
+
+def _find_sentence_end(text, min_chars):
+    """返回 text 中第一个可切分位置（切点之后的下标），没有则返回 -1"""
+    for i, ch in enumerate(text):
+        if ch not in SENTENCE_DELIMITERS or i + 1 < min_chars:
+            continue
+        if ch in ".,":
+            # 英文句点/逗号要看到下一个字符才能确定，避免把 3.14、1,000 切开
+            if i + 1 >= len(text) or text[i + 1].isdigit():
+                continue
+        return i + 1
+    return -1
+
+
+def split_sentences(pieces, min_chars=Config.MIN_SENTENCE_CHARS):
+    """把 LLM 的 token 流切成句子流：每凑够一句就立即 yield"""
+    buffer = ""
+    for piece in pieces:
+        buffer += piece
+        cut = _find_sentence_end(buffer, min_chars)
+        while cut > 0:
+            sentence, buffer = buffer[:cut].strip(), buffer[cut:]
+            if sentence:
+                yield sentence
+            cut = _find_sentence_end(buffer, min_chars)
+    if buffer.strip():
+        yield buffer.strip()
+
+
 class VoiceAssistant:
     def __init__(self):
         self.is_busy = False 
@@ -48,49 +171,231 @@ class VoiceAssistant:
         self.recording = False      # 正在录音标志
         self.frames = []            # 音频缓存
         self.last_speech_time = 0   # 上次听到声音的时间
+
+        # 打断相关状态：每一轮对话一个编号，编号变化即表示该轮已被取消
+        self.turn_id = 0
+        self.llm_lock = threading.Lock()
+        self.detector = SpeechDetector(Config.AUDIO_RATE, Config.VAD_FRAME_MS, Config.VAD_MODE)
+        # 忙碌时按 VAD 帧读取麦克风，预录缓冲按帧计数
+        self.preroll = deque(
+            maxlen=-(-Config.PREROLL_CHUNKS * Config.CHUNK // self.detector.frame_samples)
+        )
+        self.asr_stream = None      # 当前录音对应的流式识别会话
+        self.partial_text = None    # 等待预填充的最新识别中间结果
+        self.partial_ready = threading.Event()
         
         os.makedirs(Config.OUTPUT_DIR, exist_ok=True)
-        
-        # 移除 VAD，只初始化播放器
-        pygame.mixer.init()
-        
+        self.response_cache = None
+        if Config.RESPONSE_CACHE:
+            self.response_cache = ResponseCache(
+                Config.RESPONSE_CACHE_SIZE, Config.RESPONSE_CACHE_TTL, Config.RESPONSE_CACHE_DIR
+            )
+
+        # 启动各阶段耗时 (秒)，全部就绪后打印
+        self.startup_times = {"导入模块": time.time() - _PROCESS_START}
+
         print(f">>> [系统] 正在初始化 (纯音量触发版)...")
         self._load_models()
-        print(">>> [系统] 全部模型加载完成！")
+
+        # 流式播报流水线：LLM -> sentence_queue -> TTS 线程 -> 播放器环形缓冲区
+        self.sentence_queue = queue.Queue(maxsize=Config.SENTENCE_QUEUE_SIZE)
+        threading.Thread(target=self._tts_worker, daemon=True).start()
+        if Config.LLM_SPECULATIVE_PREFILL:
+            threading.Thread(target=self._prefill_worker, daemon=True).start()
 
     def _load_models(self):
+        """ASR、LLM、TTS 各用一个线程并行加载（含预热），不阻塞麦克风与 VAD 的启动"""
+        self.asr_model = None
+        self.asr_client = None
+        self.llm = None
+        self.conversation = None
+        self.tts_engine = None
+        self.player = None
+        self.load_error = None
+        self.models_ready = threading.Event()
+
+        loaders = [
+            threading.Thread(target=self._run_loader, args=(loader,), daemon=True)
+            for loader in (self._load_asr, self._load_llm, self._load_tts)
+        ]
+        for loader in loaders:
+            loader.start()
+
+        def wait_all():
+            for loader in loaders:
+                loader.join()
+            if self.load_error is None:
+                self.startup_times["全部就绪"] = time.time() - _PROCESS_START
+                print(">>> [系统] 全部模型加载完成！")
+                self.print_startup_times()
+                self.print_memory_report()
+            else:
+                self.print_startup_times()
+            self.models_ready.set()
+
+        threading.Thread(target=wait_all, daemon=True).start()
+
+    def _run_loader(self, loader):
         try:
-            print(f" -> 加载 ASR: {Config.MODEL_DIR_SENSEVOICE}")
-            self.asr_model = AutoModel(
-                model=Config.MODEL_DIR_SENSEVOICE,
-                trust_remote_code=True,
-                remote_code=os.path.join(Config.MODEL_DIR_SENSEVOICE, "model.py"),
-                device=Config.DEVICE,
-                disable_update=True,
-            )
-            
-            print(f" -> 加载 LLM: {Config.MODEL_PATH_LLM}")
-            if not os.path.exists(Config.MODEL_PATH_LLM):
-                raise FileNotFoundError(f"找不到模型文件: {Config.MODEL_PATH_LLM}")
+            loader()
+        except Exception as e:
+            print(f"!!! 模型加载失败: {e}")
+            traceback.print_exc()
+            self.load_error = e
+
+    @contextmanager
+    def _timed(self, phase):
+        """记录一个启动阶段的耗时；阶段失败时同样记录，便于看出失败前卡了多久"""
+        t = time.time()
+        failed = True
+        try:
+            yield
+            failed = False
+        finally:
+            self.startup_times[f"{phase} (失败)" if failed else phase] = time.time() - t
+
+    def print_startup_times(self):
+        print(">>> [启动耗时]")
+        for phase, seconds in self.startup_times.items():
+            print(f"    {phase:<8} {seconds:6.2f}s")
+
+    def print_memory_report(self):
+        models = {"LLM": Config.MODEL_PATH_LLM}
+        if self.asr_model is not None:
+            tensors = []
+            for value in self.asr_model.model.state_dict().values():
+                # INT8 量化后 Linear 的权重以 (weight, bias) 元组保存
+                tensors.extend(value if isinstance(value, tuple) else [value])
+            models["ASR"] = sum(t.numel() * t.element_size() for t in tensors if hasattr(t, "numel"))
+        print(">>> [内存]")
+        print(memory_report(models))
+
+    def wait_models_ready(self):
+        """识别前确认模型已就绪；启动后立即开口时在这里等待加载完成"""
+        if not self.models_ready.is_set():
+            print(">>> [系统] 模型仍在加载，加载完成后开始处理...")
+            self.models_ready.wait()
+        return self.load_error is None
+
+    def _load_asr(self):
+        with self._timed("ASR 加载"):
+            if Config.ASR_SERVER_URL:
+                self._connect_asr_server()
+            else:
+                self._load_asr_model()
+        if self.asr_model is not None:
+            with self._timed("ASR 预热"):
+                self._warmup_asr()
+
+    def _load_llm(self):
+        print(f" -> 加载 LLM: {Config.MODEL_PATH_LLM}")
+        if not os.path.exists(Config.MODEL_PATH_LLM):
+            raise FileNotFoundError(f"找不到模型文件: {Config.MODEL_PATH_LLM}")
+
+        if Config.LLM_USE_MMAP and Config.LLM_PREFAULT and not Config.LLM_MLOCK:
+            # mlock 本身会读入全部页面，无需再预读
+            with self._timed("LLM 预读"):
+                prefault(Config.MODEL_PATH_LLM)
+        if Config.LLM_MLOCK:
+            warning = check_mlock(Config.MODEL_PATH_LLM)
+            if warning:
+                print(f" -> [警告] {warning}")
+
+        with self._timed("LLM 加载"):
+            from llama_cpp import Llama
 
             self.llm = Llama(
                 model_path=Config.MODEL_PATH_LLM,
                 n_ctx=1024,
                 n_gpu_layers=0,
                 n_threads=4,
-                n_batch=512,       
-                use_mmap=False,
+                n_batch=512,
+                use_mmap=Config.LLM_USE_MMAP,
+                use_mlock=Config.LLM_MLOCK,
                 verbose=False
             )
-            
-            # 预热
+
+        with self._timed("LLM 预热"):
             print(" -> 正在预热 LLM...")
             self.llm.create_chat_completion(messages=[{"role": "user", "content": "hi"}], max_tokens=1)
-            
-        except Exception as e:
-            print(f"!!! 模型加载失败: {e}")
-            traceback.print_exc()
-            exit(1)
+
+        session = LLMSession(
+            self.llm, Config.SYSTEM_PROMPT, Config.MODEL_PATH_LLM, Config.LLM_PROMPT_CACHE_DIR
+        )
+        if Config.LLM_PROMPT_CACHE:
+            with self._timed("提示词缓存"):
+                cached = session.prepare()
+                print(f" -> 系统提示词 KV: {len(session.prefix_tokens)} tokens ({'读取快照' if cached else '已求值并保存'})")
+        self.conversation = Conversation(session, max_turns=Config.LLM_HISTORY_TURNS)
+
+    def _load_tts(self):
+        with self._timed("TTS 加载"):
+            from audio_player import PCMPlayer
+
+            self.tts_engine = self._load_tts_engine()
+            playback_rate = Config.PLAYBACK_RATE or getattr(self.tts_engine, "sample_rate", 48000)
+            self.player = PCMPlayer(
+                sample_rate=playback_rate, buffer_seconds=Config.PLAYBACK_BUFFER_SECONDS
+            )
+
+    def _load_asr_model(self):
+        from funasr import AutoModel
+
+        print(f" -> 加载 ASR: {Config.MODEL_DIR_SENSEVOICE}")
+        self.asr_model = AutoModel(
+            model=Config.MODEL_DIR_SENSEVOICE,
+            trust_remote_code=True,
+            remote_code=os.path.join(Config.MODEL_DIR_SENSEVOICE, "model.py"),
+            device=Config.DEVICE,
+            disable_update=True,
+            encoder_conf={"selfattention_layer_type": Config.ASR_ATTENTION},
+            # 作为 generate / 流式识别的默认参数传给 SenseVoiceSmall.inference
+            tp_blocks=Config.ASR_TP_BLOCKS,
+            exit_threshold=Config.ASR_EXIT_THRESHOLD,
+        )
+        if Config.ASR_FOLD_CMVN and self.asr_model.model.fold_cmvn(
+            self.asr_model.kwargs.get("frontend")
+        ):
+            print(" -> CMVN 已折叠进编码器")
+        if Config.ASR_QUANTIZE:
+            self.asr_model.model.quantize()
+            print(" -> ASR 已切换为 INT8 动态量化")
+        elif Config.ASR_PRECISION != "float32":
+            self.asr_model.model.to_precision(Config.ASR_PRECISION)
+            print(f" -> ASR 推理精度: {Config.ASR_PRECISION}")
+        if Config.ASR_COMPILE:
+            t = time.time()
+            cached = self.asr_model.model.compile_encoder(Config.ASR_COMPILE_CACHE)
+            print(f" -> ASR 编码器已编译 ({'读取缓存' if cached else '首次 trace'}，{time.time() - t:.2f}s)")
+
+    def _warmup_asr(self):
+        """用一段 1 秒的低噪声跑一遍完整识别，首句识别不再承担懒加载与首次推理的开销"""
+        print(" -> 正在预热 ASR...")
+        noise = np.random.default_rng(0).normal(0, 0.01, Config.AUDIO_RATE).astype(np.float32)
+        self.asr_model.generate(
+            input=noise, cache={}, language="auto", use_itn=False, fs=Config.AUDIO_RATE
+        )
+
+    def _connect_asr_server(self):
+        print(f" -> 使用 ASR 服务: {Config.ASR_SERVER_URL}")
+        self.asr_client = ASRClient(Config.ASR_SERVER_URL)
+        if not self.asr_client.health():
+            raise ConnectionError(f"无法连接 ASR 服务: {Config.ASR_SERVER_URL}")
+        if Config.ASR_STREAMING:
+            print(" -> [警告] 流式识别需要本地模型，使用 ASR 服务时关闭")
+
+    def _load_tts_engine(self):
+        if Config.TTS_ENGINE == "piper":
+            if os.path.exists(Config.TTS_MODEL_PATH):
+                print(f" -> 加载 TTS (离线): {Config.TTS_MODEL_PATH}")
+                return create_tts_engine("piper", model_path=Config.TTS_MODEL_PATH)
+            print(f" -> [警告] 找不到离线 TTS 模型 {Config.TTS_MODEL_PATH}，回退到 Edge TTS (需联网)")
+            return create_tts_engine("edge", voice=Config.TTS_VOICE)
+
+        print(f" -> 使用 TTS 引擎: {Config.TTS_ENGINE}")
+        if Config.TTS_ENGINE == "edge":
+            return create_tts_engine("edge", voice=Config.TTS_VOICE)
+        return create_tts_engine(Config.TTS_ENGINE)
 
     # --- 新增：计算音量函数 ---
     def calculate_volume(self, audio_data):
@@ -100,16 +405,27 @@ class VoiceAssistant:
         if len(audio_array) == 0: return 0
         return np.mean(np.abs(audio_array))
 
-    def save_audio(self):
+    def collect_audio(self):
+        """把录音帧拼接成 float32 数组 ([-1, 1])，直接交给 ASR，不经过 wav 文件"""
         if not self.frames: return None
-        
-        # 时长过滤
-        duration = (len(self.frames) * Config.CHUNK) / Config.AUDIO_RATE
+
+        # 时长过滤（打断时的预录帧比 CHUNK 短，按字节数计算）
+        pcm_bytes = b''.join(self.frames)
+        self.frames = []
+        duration = len(pcm_bytes) / 2 / Config.AUDIO_RATE
         if duration < 0.5:
             print(f"[忽略] 声音太短 ({duration:.2f}s)")
-            self.frames = []
             return None
 
+        if Config.DEBUG_SAVE_AUDIO:
+            self.save_audio(pcm_bytes)
+
+        audio = np.frombuffer(pcm_bytes, dtype=np.int16).astype(np.float32)
+        audio /= 32768.0
+        return audio
+
+    def save_audio(self, pcm_bytes):
+        """调试用：把一段 int16 PCM 保存为 wav"""
         self.audio_file_count += 1
         filename = f"{Config.OUTPUT_DIR}/audio_{self.audio_file_count}.wav"
         
@@ -117,27 +433,90 @@ class VoiceAssistant:
             wf.setnchannels(Config.AUDIO_CHANNELS)
             wf.setsampwidth(2)
             wf.setframerate(Config.AUDIO_RATE)
-            wf.writeframes(b''.join(self.frames))
+            wf.writeframes(pcm_bytes)
         
-        self.frames = []
+        print(f"[调试] 录音已保存: {filename}")
         return filename
 
     def clean_asr_text(self, text):
         text = re.sub(r'<\|.*?\|>', '', text)
         return text.strip()
 
-    def process_inference(self, audio_path):
-        if not audio_path or not os.path.exists(audio_path): 
+    def is_cancelled(self, turn):
+        return turn != self.turn_id
+
+    def start_asr_stream(self, frames):
+        """开始录音时创建流式识别会话，并补送已录下的音频块"""
+        if not Config.ASR_STREAMING or self.asr_model is None:
+            return
+        from streaming_asr import StreamingASR
+
+        self.asr_stream = StreamingASR(
+            self.asr_model,
+            sample_rate=Config.AUDIO_RATE,
+            chunk_size=Config.ASR_CHUNK_SIZE,
+            look_back=Config.ASR_LOOK_BACK,
+            on_partial=self.on_partial_text if Config.LLM_SPECULATIVE_PREFILL else None,
+        )
+        for data in frames:
+            self.asr_stream.feed(data)
+
+    def on_partial_text(self, text):
+        """流式识别的中间结果回调（识别线程）：只保留最新一条，交给预填充线程"""
+        self.partial_text = self.clean_asr_text(text)
+        self.partial_ready.set()
+
+    def _prefill_worker(self):
+        """投机预填充：LLM 空闲时把最新的中间结果写入 KV 缓存，过时的结果直接跳过"""
+        while True:
+            self.partial_ready.wait()
+            self.partial_ready.clear()
+            text = self.partial_text
+            if not text or self.conversation is None or self.is_busy:
+                continue
+            # LLM 正在生成上一轮回复（如刚被打断）时不等待，下一条中间结果再试
+            if not self.llm_lock.acquire(blocking=False):
+                continue
+            try:
+                self.conversation.prefill(text)
+            except Exception as e:
+                print(f"\n[预填充 Error] {e}")
+            finally:
+                self.llm_lock.release()
+
+    def take_asr_stream(self):
+        asr_stream, self.asr_stream = self.asr_stream, None
+        return asr_stream
+
+    def recognize(self, audio, asr_stream=None):
+        """ASR：流式会话按配置取流式最终结果，否则整段识别"""
+        if asr_stream is not None:
+            if Config.ASR_STREAMING_OFFLINE_FINAL:
+                asr_stream.cancel()
+            else:
+                text = asr_stream.finish()
+                if text is not None:
+                    return text
+        if self.asr_client is not None:
+            return self.asr_client.recognize(audio, Config.AUDIO_RATE)["raw_text"]
+        # 直接传入内存中的音频，由 funasr 从 AUDIO_RATE 重采样到 16k
+        res = self.asr_model.generate(
+            input=audio, cache={}, language="auto", use_itn=False, fs=Config.AUDIO_RATE
+        )
+        return res[0].get('text', "") if isinstance(res, list) else res.get('text', "")
+
+    def process_inference(self, audio, turn, asr_stream=None):
+        if audio is None or len(audio) == 0:
             self.is_busy = False
             return
 
         try:
             print(f"\n--- 处理中 ---")
+            if not self.wait_models_ready():
+                return
             t_start = time.time()
             
-            # ASR
-            res = self.asr_model.generate(input=audio_path, cache={}, language="auto", use_itn=False)
-            raw_text = res[0].get('text', "") if isinstance(res, list) else res.get('text', "")
+            raw_text = self.recognize(audio, asr_stream)
             user_text = self.clean_asr_text(raw_text)
             print(f"┌── [听到]: {user_text}")
 
@@ -145,62 +524,196 @@ class VoiceAssistant:
                 print(f"└── [忽略] 无效")
                 return 
 
+            if self.is_cancelled(turn):
+                return
+
+            if self.response_cache is not None:
+                cached = self.response_cache.get(user_text)
+                if cached is not None:
+                    self.play_cached_reply(user_text, *cached, t_start, turn)
+                    return
+
             # LLM
             print("│   思考中...", end="", flush=True)
-            messages = [
-                {"role": "system", "content": Config.SYSTEM_PROMPT},
-                {"role": "user", "content": user_text}
-            ]
+            if Config.STREAM_TTS:
+                result = self.stream_reply_and_play(user_text, t_start, turn)
+                if result is not None:
+                    self.cache_reply(user_text, *result)
+                return
             
-            output = self.llm.create_chat_completion(
-                messages=messages,
-                max_tokens=256,
-                temperature=0.7,
-            )
-            
-            ai_response = output['choices'][0]['message']['content']
+            with self.llm_lock:
+                output = self.conversation.chat(
+                    user_text,
+                    max_tokens=256,
+                    temperature=0.7,
+                )
+                ai_response = output['choices'][0]['message']['content']
+                self.conversation.record(user_text, ai_response)
             t_cost = time.time() - t_start
             print(f"\r└── [回复] ({t_cost:.2f}s): {ai_response}")
 
             # TTS
-            if ai_response:
-                self.text_to_speech_and_play(ai_response)
+            if ai_response and not self.is_cancelled(turn):
+                speech = self.text_to_speech_and_play(ai_response, turn)
+                if not self.is_cancelled(turn):
+                    self.cache_reply(user_text, ai_response, speech)
 
         except Exception as e:
             print(f"\n[Error] {e}")
             traceback.print_exc()
         finally:
-            if os.path.exists(audio_path):
-                try: os.remove(audio_path)
-                except: pass
-            
-            self.is_busy = False
-            self.recording = False # 确保重置录音状态
-            print(f">>> [状态] 恢复监听...")
+            # 被打断的轮次不再改动状态，新一轮已经接管录音
+            if not self.is_cancelled(turn):
+                self.is_busy = False
+                self.recording = False # 确保重置录音状态
+                print(f">>> [状态] 恢复监听...")
+
+    def stream_reply_and_play(self, user_text, t_start, turn):
+        """
+        流式生成回复：每切出一句就送入合成队列，生成与合成、播放并行
 
-    def text_to_speech_and_play(self, text):
-        tts_file = os.path.join(Config.OUTPUT_DIR, f"temp_tts_{self.audio_file_count}.mp3")
+        Returns:
+            (回复, 逐句的 [(pcm, sample_rate)])；被打断时返回 None
+        """
+        playback_done = threading.Event()
+        reply = []
+        speech = []
+        generated = []  # 原样记入对话历史，与 KV 缓存中的 token 一致
+        with self.llm_lock:
+            stream = self.conversation.chat(
+                user_text,
+                max_tokens=256,
+                temperature=0.7,
+                stream=True,
+            )
+
+            def token_pieces():
+                for chunk in stream:
+                    if self.is_cancelled(turn):
+                        return
+                    piece = chunk['choices'][0]['delta'].get('content')
+                    if piece:
+                        generated.append(piece)
+                        yield piece
+
+            try:
+                for sentence in split_sentences(token_pieces()):
+                    if not reply:
+                        print(f"\r│   [首句] ({time.time() - t_start:.2f}s): {sentence}")
+                    reply.append(sentence)
+                    self.sentence_queue.put((turn, sentence, speech))  # 队列满时阻塞，形成背压
+                    if self.is_cancelled(turn):
+                        break
+            finally:
+                stream.close()  # 提前结束时终止 llama.cpp 的生成
+                self.sentence_queue.put((turn, None, playback_done))  # 本轮结束标记
+                self.conversation.record(user_text, "".join(generated))
+
+        t_cost = time.time() - t_start
+        if self.is_cancelled(turn):
+            print(f"└── [打断] ({t_cost:.2f}s): {''.join(reply)}")
+            return None
+        print(f"└── [回复] ({t_cost:.2f}s): {''.join(reply)}")
+        while not playback_done.wait(0.05):
+            if self.is_cancelled(turn):
+                return None
+        return "".join(reply), speech if len(speech) == len(reply) else []
+
+    def play_cached_reply(self, user_text, reply, speech, t_start, turn):
+        """回复缓存命中：直接播放缓存的音频，只缓存了文本时照常合成"""
+        print(f"└── [缓存] ({time.time() - t_start:.2f}s): {reply}  ({self.response_cache.stats()})")
+        with self.llm_lock:
+            self.conversation.record(user_text, reply)
+
+        if speech is None:
+            playback_done = threading.Event()
+            speech = []
+            sentences = list(split_sentences([reply]))
+            for sentence in sentences:
+                self.sentence_queue.put((turn, sentence, speech))
+            self.sentence_queue.put((turn, None, playback_done))
+            while not playback_done.wait(0.05):
+                if self.is_cancelled(turn):
+                    return
+            if Config.RESPONSE_CACHE_AUDIO and len(speech) == len(sentences):
+                self.cache_reply(user_text, reply, speech)  # 补上音频，下次命中时不必再合成
+            return
+
+        for pcm, sample_rate in speech:
+            generation = self.player.generation
+            if self.is_cancelled(turn):
+                return
+            playback_done = self.player.write(pcm, sample_rate, generation=generation)
+        while not playback_done.wait(0.05):
+            if self.is_cancelled(turn):
+                return
+
+    def cache_reply(self, user_text, reply, speech):
+        """完整播放的回复写入缓存；speech 为空（有句子合成失败）时只缓存文本"""
+        if self.response_cache is None:
+            return
+        if not Config.RESPONSE_CACHE_AUDIO or not speech:
+            speech = None
+        self.response_cache.put(user_text, reply, speech)
+
+    def _tts_worker(self):
+        while True:
+            turn, text, arg = self.sentence_queue.get()
+            try:
+                if text is None:
+                    # 本轮结束标记：arg 为本轮最后一段音频播放完毕时由声卡回调置位的 Event
+                    self.player.mark(on_done=arg.set)
+                    continue
+                if self.is_cancelled(turn):
+                    continue  # 已被打断的轮次，丢弃剩余句子
+                speech = self.synthesize_speech(text)
+                # 先取播放代次再检查是否被打断：barge_in 先改 turn_id 再 clear()，
+                # 检查之后才发生的打断会让 write() 按代次丢弃这句
+                generation = self.player.generation
+                if speech is not None and not self.is_cancelled(turn):
+                    arg.append(speech)  # arg 收集本轮合成的音频，供回复缓存使用
+                    self.player.write(*speech, generation=generation)  # 缓冲区满时阻塞，形成背压
+            except Exception as e:
+                # 播放出错也不能让唯一的合成线程退出，否则队列写满后生成线程会一直阻塞
+                print(f"[播放 Error] {e}")
+                if text is None:
+                    arg.set()  # 释放等待本轮播放结束的线程
+
+    def text_to_speech_and_play(self, text, turn):
+        """合成并播放整段回复，返回 [(pcm, sample_rate)]，合成失败或被打断时为空列表"""
+        speech = self.synthesize_speech(text)
+        generation = self.player.generation
+        if speech is None or self.is_cancelled(turn):
+            return []
+        self.player.write(*speech, generation=generation).wait()
+        return [speech]
+
+    def synthesize_speech(self, text):
+        """合成一句话，返回 (pcm, sample_rate)；失败返回 None"""
         try:
-            voice = "zh-CN-XiaoyiNeural"
-            asyncio.run(self._edge_tts_save(text, voice, tts_file))
-            
-            pygame.mixer.music.load(tts_file)
-            pygame.mixer.music.play()
-            while pygame.mixer.music.get_busy():
-                time.sleep(0.1)
-            pygame.mixer.music.unload() 
+            pcm, sample_rate = self.tts_engine.synthesize(text)
+            if len(pcm) == 0:
+                return None
+            return pcm, sample_rate
         except Exception as e:
             print(f"[TTS Error] {e}")
-        finally:
-            if os.path.exists(tts_file):
-                try: os.remove(tts_file)
-                except: pass
+            return None
 
-    async def _edge_tts_save(self, text, voice, output_file):
-        communicate = edge_tts.Communicate(text, voice)
-        await communicate.save(output_file)
+    def barge_in(self):
+        """用户在回复期间开口：取消当前轮的生成、合成与播放，并立即开始新一轮录音"""
+        print("\n[打断] 检测到新的说话，停止当前回复")
+        self.turn_id += 1
+        if self.player is not None:
+            self.player.clear()
+        self.is_busy = False
+        self.recording = True
+        self.frames = list(self.preroll)
+        self.last_speech_time = time.time()
+        self.start_asr_stream(self.frames)
 
     def audio_listener_loop(self):
+        import pyaudio
+
         p = pyaudio.PyAudio()
         stream = p.open(format=pyaudio.paInt16,
                         channels=Config.AUDIO_CHANNELS,
@@ -208,16 +721,30 @@ class VoiceAssistant:
                         input=True,
                         frames_per_buffer=Config.CHUNK)
 
-        print("\n>>> 监听中 (基于音量触发)...")
+        # 模型仍在后台加载，此时即可开始录音与 VAD
+        self.startup_times["开始监听"] = time.time() - _PROCESS_START
+        print(f"\n>>> 监听中 (基于音量触发)... 启动 {self.startup_times['开始监听']:.2f}s")
         self.running = True
         
         while self.running:
+            if self.load_error is not None:
+                break
             try:
-                data = stream.read(Config.CHUNK, exception_on_overflow=False)
-                
-                # 忙碌时不处理音频
+                # 忙碌时每次只读一个 VAD 帧，打断检测不必等满一个 CHUNK (约 85ms)
+                barge_in_check = self.is_busy and Config.BARGE_IN
+                n = self.detector.frame_samples if barge_in_check else Config.CHUNK
+                data = stream.read(n, exception_on_overflow=False)
+
+                # VAD 持续运行；播放期间使用更高的音量门限以过滤回声
+                playing = self.player is not None and self.player.is_playing
+                barge_in_volume = Config.BARGE_IN_MIN_VOLUME if playing else Config.MIN_VOLUME
+                speech = self.detector.update(data, barge_in_volume, Config.BARGE_IN_FRAMES)
+
+                # 忙碌时只做打断检测
                 if self.is_busy:
-                    time.sleep(0.02)
+                    self.preroll.append(data)
+                    if barge_in_check and speech:
+                        self.barge_in()
                     continue
 
                 # --- 核心修改：音量检测逻辑 ---
@@ -234,9 +761,12 @@ class VoiceAssistant:
                         self.recording = True
                         self.frames = [data]
                         self.last_speech_time = time.time()
+                        self.start_asr_stream(self.frames)
                 else:
                     # [状态：正在录音]
                     self.frames.append(data)
+                    if self.asr_stream is not None:
+                        self.asr_stream.feed(data)
                     
                     if volume > Config.MIN_VOLUME:
                         # 只要还在说话，就刷新计时器
@@ -245,11 +775,19 @@ class VoiceAssistant:
                     # 如果持续安静超过设定时间，认为说话结束
                     if time.time() - self.last_speech_time > Config.SILENCE_TIMEOUT:
                         print("[结束] 说话结束")
-                        wav_path = self.save_audio()
-                        if wav_path:
+                        audio = self.collect_audio()
+                        asr_stream = self.take_asr_stream()
+                        if audio is not None:
                             self.is_busy = True
-                            threading.Thread(target=self.process_inference, args=(wav_path,)).start()
+                            self.turn_id += 1
+                            self.preroll.clear()
+                            threading.Thread(
+                                target=self.process_inference,
+                                args=(audio, self.turn_id, asr_stream),
+                            ).start()
                         else:
+                            if asr_stream is not None:
+                                asr_stream.cancel()
                             self.recording = False # 没保存成功（太短），重置状态
 
             except IOError:
@@ -267,6 +805,10 @@ class VoiceAssistant:
             self.audio_listener_loop()
         except KeyboardInterrupt:
             self.running = False
+        if self.response_cache is not None:
+            self.response_cache.flush()  # 写完后台尚未落盘的缓存条目
+        if self.load_error is not None:
+            exit(1)
 
 if __name__ == "__main__":
     assistant = VoiceAssistant()